@@ -1,7 +1,7 @@
 @echo off
 
 REM Build the application
-pyinstaller --name "valorant-zone-stats" --icon resources/ui/favicon.ico --add-data resources/maps;resources/maps --add-data resources/ui;resources/ui --windowed --noconfirm src/app.py
+pyinstaller --name "valorant-zone-stats" --icon resources/ui/favicon.ico --add-data resources/maps;resources/maps --add-data resources/ui;resources/ui --add-data resources/compression;resources/compression --windowed --noconfirm src/app.py
 
 REM Remove unnecessary dlls
 cd "dist\valorant-zone-stats"
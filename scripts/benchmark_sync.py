@@ -0,0 +1,141 @@
+"""
+End-to-end benchmark of a cold match sync (ValorantAPI -> ApiService -> MatchService.process_matches) against the
+mock PD server. Reports matches/second and peak RSS for each history size.
+
+Run from the root directory of the project:
+    python scripts/benchmark_sync.py --sizes 100 1000 10000 --latency 80 --jitter 40
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def get_peak_rss() -> int:
+    """
+    :return: peak resident set size of this process in bytes
+    """
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                 ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize
+    import resource
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_mock_server(args: argparse.Namespace, port: int) -> subprocess.Popen:
+    """
+    Run the mock server in its own process, so generating matches doesn't compete with the sync for the GIL.
+    """
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            'mock_pd_server.py'),
+                               '--port', str(port), '--matches', str(args.run_one),
+                               '--latency', str(args.latency), '--jitter', str(args.jitter),
+                               '--rate-limit', str(args.rate_limit), '--retry-after', str(args.retry_after)],
+                              stdout=subprocess.PIPE, text=True)
+    # Wait for the server to announce that it is listening
+    server.stdout.readline()
+    return server
+
+
+def run_one(args: argparse.Namespace) -> Dict:
+    """
+    Sync one history size in this process, against a mock server running in a child process.
+    """
+    # The storage path is read when src.utils is imported, so point it at a scratch directory first
+    os.environ['APPDATA'] = tempfile.mkdtemp(prefix='vzs-benchmark-')
+
+    from scripts.mock_pd_server import MockPUUID
+    from src.api.api import RequestScheduler
+    from src.services.api_service import ApiService
+    from src.services.map_service import MapService
+    from src.services.match_service import MatchService
+
+    port: int = get_free_port()
+    server: subprocess.Popen = start_mock_server(args, port)
+
+    api_service = ApiService('NA', pool_size=args.concurrency)
+    api_service.api.pd_url_override = f'http://127.0.0.1:{port}'
+    api_service.api.scheduler = RequestScheduler(rate_limits={'127.0.0.1': (args.rate, max(1, int(args.rate)))})
+    api_service.api.cached_headers = {'Authorization': 'Bearer mock', 'X-Riot-Entitlements-JWT': 'mock'}
+    api_service.puuid = MockPUUID
+    api_service.is_authed = True
+
+    map_service = MapService()
+    map_service.load_maps()
+    match_service = MatchService(api_service, map_service, fetch_concurrency=args.concurrency)
+
+    start: float = time.perf_counter()
+    matches = match_service.process_matches(MockPUUID, lambda progress: None, incremental=False)
+    elapsed: float = time.perf_counter() - start
+
+    server.terminate()
+    server.wait()
+    match_service.on_close()
+    api_service.on_close()
+    return {'size': args.run_one, 'stored': len(matches), 'seconds': elapsed,
+            'matches_per_second': args.run_one / elapsed if elapsed > 0 else 0.0,
+            'peak_rss': get_peak_rss()}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Benchmark a cold match sync against the mock PD server.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--concurrency', type=int, default=8, help='fetch workers and pooled connections')
+    parser.add_argument('--rate', type=float, default=1000.0, help='client-side requests per second')
+    parser.add_argument('--latency', type=float, default=50.0, help='mock latency per request in ms')
+    parser.add_argument('--jitter', type=float, default=20.0, help='mock latency variation in ms')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='probability of the mock answering 429')
+    parser.add_argument('--retry-after', type=float, default=1.0)
+    parser.add_argument('--run-one', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_one is not None:
+        print(json.dumps(run_one(args)))
+        return
+
+    # Every size runs in a fresh process so the peak RSS of one doesn't carry over to the next
+    print(f'{"matches":>8} {"stored":>8} {"seconds":>9} {"matches/s":>10} {"peak RSS":>10}')
+    for size in args.sizes:
+        command: List[str] = [sys.executable, os.path.abspath(__file__), '--run-one', str(size),
+                              '--concurrency', str(args.concurrency), '--rate', str(args.rate),
+                              '--latency', str(args.latency), '--jitter', str(args.jitter),
+                              '--rate-limit', str(args.rate_limit), '--retry-after', str(args.retry_after)]
+        output = subprocess.run(command, capture_output=True, text=True)
+        if output.returncode != 0:
+            print(output.stderr, file=sys.stderr)
+            continue
+        result: Dict = json.loads(output.stdout.strip().splitlines()[-1])
+        print(f'{result["size"]:>8} {result["stored"]:>8} {result["seconds"]:>9.2f} '
+              f'{result["matches_per_second"]:>10.1f} {result["peak_rss"] / 1024 / 1024:>8.1f}MB')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,304 @@
+"""
+Local stand-in for the VALORANT PD server, serving match history, match details and player names from generated
+or recorded fixtures. Used to benchmark the fetch path without a Riot account.
+
+Run from the root directory of the project:
+    python scripts/mock_pd_server.py --matches 1000 --latency 80 --jitter 40 --rate-limit 0.01
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib import parse
+
+MockPUUID = '8d2c0c4a-5c0e-5d2b-9b8a-2f4e6b1c0d00'
+BombGameMode = '/Game/GameModes/Bomb/BombGameMode.BombGameMode_C'
+Queues = ('competitive', 'unrated', 'custom')
+FirstGameStartMillis = 1600000000000
+
+
+def load_map_metadata() -> List[Dict]:
+    return [json.loads(path.read_text()) for path in sorted(Path('resources/maps').glob('*.json'))]
+
+
+class MatchGenerator:
+    """
+    Builds match details deterministically from the match index, so any history size can be served without
+    keeping the matches in memory.
+    """
+
+    Rounds: int = 22
+    KillsPerRound: int = 7
+
+    def __init__(self, match_count: int, ignored_ratio: float = 0.1):
+        self.match_count: int = match_count
+        self.ignored_ratio: float = ignored_ratio
+        self.maps: List[Dict] = load_map_metadata()
+        self.players: List[str] = [MockPUUID] + [f'{i:08x}-0000-4000-8000-{i:012x}' for i in range(1, 10)]
+
+    @staticmethod
+    def get_match_id(index: int) -> str:
+        return f'{index:08x}-6d6f-4b63-8000-{index:012x}'
+
+    @staticmethod
+    def get_index(match_id: str) -> Optional[int]:
+        try:
+            return int(match_id.split('-')[0], 16)
+        except ValueError:
+            return None
+
+    def get_queue(self, index: int) -> str:
+        return Queues[index % len(Queues)]
+
+    def get_history(self, queue: str) -> List[Dict]:
+        """
+        :return: the history entries of a queue, newest first
+        """
+        return [{'MatchID': self.get_match_id(index), 'GameStartTime': FirstGameStartMillis + index * 3600000,
+                 'QueueID': '' if queue == 'custom' else queue}
+                for index in range(self.match_count - 1, -1, -1) if self.get_queue(index) == queue]
+
+    def _location(self, rng: random.Random, game_map: Dict) -> Dict[str, int]:
+        # Invert GameMap.normalize_point for a random point on the minimap
+        x, y = rng.uniform(0.1, 0.9), rng.uniform(0.1, 0.9)
+        return {'x': int((y - game_map['offset']['y']) / game_map['multiplier']['y']),
+                'y': int((x - game_map['offset']['x']) / game_map['multiplier']['x'])}
+
+    def get_match(self, index: int) -> Dict:
+        rng: random.Random = random.Random(index)
+        game_map: Dict = self.maps[index % len(self.maps)]
+        queue: str = self.get_queue(index)
+        teams: Dict[str, str] = {player: 'Red' if i < 5 else 'Blue' for i, player in enumerate(self.players)}
+
+        kills: List[Dict] = []
+        round_results: List[Dict] = []
+        for round_num in range(MatchGenerator.Rounds):
+            plant_round_time: int = rng.choice((0, rng.randint(30000, 90000)))
+            round_kills: List[Dict] = []
+            for _ in range(rng.randint(3, MatchGenerator.KillsPerRound)):
+                killer, victim = rng.sample(self.players, 2)
+                round_time: int = rng.randint(0, 100000)
+                round_kills.append({
+                    'gameTime': round_num * 100000 + round_time,
+                    'roundTime': round_time,
+                    'round': round_num,
+                    'killer': killer,
+                    'victim': victim,
+                    'victimLocation': self._location(rng, game_map),
+                    'assistants': [],
+                    'playerLocations': [{'subject': player, 'viewRadians': rng.uniform(0, 6.28),
+                                         'location': self._location(rng, game_map)} for player in self.players],
+                    'finishingDamage': {'damageType': 'Weapon', 'damageItem': '', 'isSecondaryFireMode': False}
+                })
+            kills.extend(round_kills)
+            round_results.append({
+                'roundNum': round_num,
+                'roundResult': 'Eliminated',
+                'winningTeam': rng.choice(('Red', 'Blue')),
+                'plantRoundTime': plant_round_time,
+                'playerStats': [{
+                    'subject': player,
+                    'kills': [kill for kill in round_kills if kill['killer'] == player],
+                    'damage': [{'receiver': other, 'damage': rng.randint(0, 150), 'legshots': rng.randint(0, 2),
+                                'bodyshots': rng.randint(0, 4), 'headshots': rng.randint(0, 2)}
+                               for other in self.players if teams[other] != teams[player]],
+                    'score': rng.randint(0, 600),
+                    'economy': {'loadoutValue': rng.randint(0, 5000), 'weapon': '', 'armor': '',
+                                'remaining': rng.randint(0, 9000), 'spent': rng.randint(0, 5000)},
+                    'ability': {}
+                } for player in self.players]
+            })
+
+        return {
+            'matchInfo': {
+                'matchId': self.get_match_id(index),
+                'mapId': game_map['mapId'],
+                'gameStartMillis': FirstGameStartMillis + index * 3600000,
+                'provisioningFlowID': 'CustomGame' if queue == 'custom' else 'Matchmaking',
+                'queueID': '' if queue == 'custom' else queue,
+                'gameMode': '/Game/GameModes/Deathmatch/DeathmatchGameMode.DeathmatchGameMode_C'
+                if rng.random() < self.ignored_ratio else BombGameMode
+            },
+            'players': [{
+                'subject': player,
+                'gameName': f'Player{i}',
+                'tagLine': 'MOCK',
+                'teamId': teams[player],
+                'stats': {'score': rng.randint(2000, 8000), 'kills': rng.randint(5, 30), 'deaths': rng.randint(5, 25),
+                          'assists': rng.randint(0, 15), 'roundsPlayed': MatchGenerator.Rounds}
+            } for i, player in enumerate(self.players)],
+            'bots': [],
+            'coaches': [],
+            'teams': [{'teamId': 'Red', 'won': True, 'roundsWon': 13}, {'teamId': 'Blue', 'won': False, 'roundsWon': 9}],
+            'roundResults': round_results,
+            'kills': kills
+        }
+
+
+class RecordedMatches:
+    """
+    Serves match details recorded as JSON files named after their match ID.
+    """
+
+    def __init__(self, directory: str):
+        self.matches: Dict[str, Path] = {path.stem: path for path in Path(directory).glob('*.json')}
+        self.start_times: Dict[str, int] = {}
+        self.queues: Dict[str, str] = {}
+        for match_id, path in self.matches.items():
+            match_info: Dict = json.loads(path.read_text())['matchInfo']
+            self.start_times[match_id] = match_info['gameStartMillis']
+            self.queues[match_id] = 'custom' if match_info['provisioningFlowID'] == 'CustomGame' \
+                else match_info['queueID']
+
+    def get_history(self, queue: str) -> List[Dict]:
+        history = [{'MatchID': match_id, 'GameStartTime': self.start_times[match_id], 'QueueID': queue}
+                   for match_id in self.matches if self.queues[match_id] == queue]
+        return sorted(history, key=lambda entry: entry['GameStartTime'], reverse=True)
+
+    def get_match(self, match_id: str) -> Optional[Dict]:
+        path: Optional[Path] = self.matches.get(match_id, None)
+        return None if path is None else json.loads(path.read_text())
+
+
+class MockPDServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, generator: Optional[MatchGenerator] = None,
+                 recorded: Optional[RecordedMatches] = None, latency: float = 0.0, jitter: float = 0.0,
+                 rate_limit_probability: float = 0.0, retry_after: float = 1.0):
+        super().__init__(address, MockPDRequestHandler)
+        self.generator: Optional[MatchGenerator] = generator
+        self.recorded: Optional[RecordedMatches] = recorded
+        self.latency: float = latency
+        self.jitter: float = jitter
+        self.rate_limit_probability: float = rate_limit_probability
+        self.retry_after: float = retry_after
+        self.histories: Dict[str, List[Dict]] = {}
+        self.histories_lock: threading.Lock = threading.Lock()
+        self.request_count: int = 0
+        self.rate_limited_count: int = 0
+
+    def get_history(self, queue: str) -> List[Dict]:
+        with self.histories_lock:
+            if queue not in self.histories:
+                source = self.generator if self.generator is not None else self.recorded
+                self.histories[queue] = source.get_history(queue)
+            return self.histories[queue]
+
+    def get_match(self, match_id: str) -> Optional[Dict]:
+        if self.recorded is not None:
+            return self.recorded.get_match(match_id)
+        index: Optional[int] = MatchGenerator.get_index(match_id)
+        if index is None or not 0 <= index < self.generator.match_count:
+            return None
+        return self.generator.get_match(index)
+
+
+class MockPDRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    server: MockPDServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload, headers: Optional[Dict[str, str]] = None):
+        body: bytes = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate_network(self) -> bool:
+        """
+        Wait out the configured latency, then maybe rate limit the request.
+        :return: whether the request was rate limited
+        """
+        self.server.request_count += 1
+        delay: float = self.server.latency + random.uniform(-self.server.jitter, self.server.jitter)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if random.random() < self.server.rate_limit_probability:
+            self.server.rate_limited_count += 1
+            self._send_json(429, {'httpStatus': 429, 'errorCode': 'RATE_LIMITED'},
+                            {'Retry-After': str(self.server.retry_after)})
+            return True
+        return False
+
+    def do_GET(self):
+        if self._simulate_network():
+            return
+        url = parse.urlsplit(self.path)
+        params: Dict[str, str] = dict(parse.parse_qsl(url.query))
+        parts: List[str] = url.path.strip('/').split('/')
+        if parts[:3] == ['match-history', 'v1', 'history'] and len(parts) == 4:
+            history: List[Dict] = self.server.get_history(params.get('queue', '') or 'competitive')
+            start_index: int = int(params.get('startIndex', 0))
+            end_index: int = int(params.get('endIndex', 20))
+            self._send_json(200, {'Subject': parts[3], 'BeginIndex': start_index, 'EndIndex': end_index,
+                                  'Total': len(history), 'History': history[start_index:end_index]})
+        elif parts[:3] == ['match-details', 'v1', 'matches'] and len(parts) == 4:
+            match: Optional[Dict] = self.server.get_match(parts[3])
+            if match is None:
+                self._send_json(404, {'httpStatus': 404, 'errorCode': 'MATCH_NOT_FOUND'})
+            else:
+                self._send_json(200, match)
+        else:
+            self._send_json(404, {'httpStatus': 404, 'errorCode': 'RESOURCE_NOT_FOUND'})
+
+    def do_PUT(self):
+        body: bytes = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self._simulate_network():
+            return
+        if self.path.rstrip('/') == '/name-service/v2/players':
+            puuids: List[str] = json.loads(body or b'[]')
+            self._send_json(200, [{'DisplayName': '', 'Subject': puuid, 'GameName': f'Mock{i}', 'TagLine': 'MOCK'}
+                                  for i, puuid in enumerate(puuids)])
+        else:
+            self._send_json(404, {'httpStatus': 404, 'errorCode': 'RESOURCE_NOT_FOUND'})
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Serve a stand-in PD API from generated or recorded matches.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--matches', type=int, default=100, help='number of generated matches')
+    parser.add_argument('--fixtures', help='directory of recorded match details (<match id>.json)')
+    parser.add_argument('--latency', type=float, default=0.0, help='added latency per request in ms')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random latency variation in ms')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='probability of answering 429')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After of 429 responses in s')
+    return parser.parse_args(argv)
+
+
+def create_server(args: argparse.Namespace) -> MockPDServer:
+    return MockPDServer((args.host, args.port),
+                        generator=None if args.fixtures else MatchGenerator(args.matches),
+                        recorded=RecordedMatches(args.fixtures) if args.fixtures else None,
+                        latency=args.latency, jitter=args.jitter, rate_limit_probability=args.rate_limit,
+                        retry_after=args.retry_after)
+
+
+def main(argv: Optional[List[str]] = None):
+    server: MockPDServer = create_server(parse_args(argv))
+    print(f'Serving mock PD on http://{server.server_address[0]}:{server.server_address[1]} '
+          f'(puuid {MockPUUID})', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
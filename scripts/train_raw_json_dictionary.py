@@ -0,0 +1,83 @@
+"""
+Train a zlib preset dictionary for the compressed raw_json column from the matches stored in a matches.db.
+
+Run from the root directory of the project:
+    python scripts/train_raw_json_dictionary.py path/to/matches.db --version 2
+
+Then register the new file in CompressedJSONField.Dictionaries and bump CompressedJSONField.CurrentVersion. Older
+dictionaries must stay, since rows compressed with them are still read back with them.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import zlib
+from collections import Counter
+from typing import List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.match_service import CompressedJSONField
+
+
+def load_samples(database: str, count: int) -> List[bytes]:
+    connection = sqlite3.connect(database)
+    try:
+        rows = connection.execute('SELECT raw_json FROM matchmodel ORDER BY RANDOM() LIMIT ?', (count,)).fetchall()
+    finally:
+        connection.close()
+    field = CompressedJSONField()
+    return [field.python_value(row[0]).encode('utf-8') for row in rows]
+
+
+def train(samples: List[bytes], size: int, segment: int) -> bytes:
+    """
+    Pick the segments that occur in the most payloads. zlib finds matches closer to the end of the dictionary
+    more cheaply, so the most common segments go last.
+    """
+    counts = Counter()
+    for sample in samples:
+        counts.update({sample[i:i + segment] for i in range(0, len(sample) - segment, segment // 4)})
+
+    chosen: List[bytes] = []
+    total: int = 0
+    for chunk, occurrences in counts.most_common():
+        if occurrences < 2 or total + len(chunk) > size:
+            break
+        chosen.append(chunk)
+        total += len(chunk)
+    return b''.join(reversed(chosen))
+
+
+def measure(samples: List[bytes], dictionary: bytes) -> float:
+    raw: int = sum(len(sample) for sample in samples)
+    compressed: int = 0
+    for sample in samples:
+        compressor = zlib.compressobj(CompressedJSONField.CompressionLevel, zdict=dictionary)
+        compressed += len(compressor.compress(sample) + compressor.flush())
+    return raw / compressed if compressed else 0.0
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Train a preset dictionary for compressing raw_json.')
+    parser.add_argument('database')
+    parser.add_argument('--version', type=int, required=True)
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--size', type=int, default=32 * 1024, help='zlib uses at most the last 32KB')
+    parser.add_argument('--segment', type=int, default=64)
+    args = parser.parse_args(argv)
+
+    samples: List[bytes] = load_samples(args.database, args.samples)
+    dictionary: bytes = train(samples, args.size, args.segment)
+    current: bytes = CompressedJSONField.get_dictionary(CompressedJSONField.CurrentVersion)
+    print(f'Compression ratio with dictionary v{CompressedJSONField.CurrentVersion}: '
+          f'{measure(samples, current):.1f}x, trained: {measure(samples, dictionary):.1f}x')
+
+    path: str = os.path.join(CompressedJSONField.DictionaryDirectory, f'match_details_v{args.version}.dict')
+    with open(path, 'wb') as f:
+        f.write(dictionary)
+    print(f'Wrote {len(dictionary)} bytes to {path}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
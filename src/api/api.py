@@ -8,17 +8,27 @@ from urllib3 import PoolManager
 import traceback
 import os
 import base64
-from typing import Optional, Dict, Tuple, Union, List
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Tuple, Union, List, Callable, Iterable, TypeVar
 import urllib3
 import json
 import yaml
 import re
 from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
 from enum import Enum
-from src.utils import logger
+from src.utils import FileManager, logger
+from src.api.cache import ResponseCache, CachedResponse
 
 urllib3.disable_warnings()
 
+T = TypeVar('T')
+R = TypeVar('R')
+
 
 class ValorantConstants:
     DebugMatchUUID = "" #if not empty shorts _get_all_stored_match_ids to only return this match from the db below, does not fetch online matches, forces stats to re-parse as well
@@ -120,6 +130,170 @@ class ValorantConstants:
         Blue = 'Blue'
 
 
+class ApiRequestError(Exception):
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code: Optional[int] = status_code
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average, with bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate: float = rate
+        self.capacity: int = capacity
+        self.tokens: float = capacity
+        self.updated_at: float = time.monotonic()
+        self.paused_until: float = 0.0
+        self.lock: threading.Lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated_at) * self.rate)
+        self.updated_at = max(self.updated_at, now)
+
+    def try_acquire(self) -> bool:
+        with self.lock:
+            now: float = time.monotonic()
+            self._refill(now)
+            if now < self.paused_until or self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def acquire(self):
+        """
+        Take a token, sleeping until one is available.
+        """
+        while True:
+            with self.lock:
+                now: float = time.monotonic()
+                if now < self.paused_until:
+                    wait: float = self.paused_until - now
+                else:
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """
+        Hand out no tokens for the given number of seconds, then restart from an empty bucket.
+        """
+        with self.lock:
+            resume_at: float = time.monotonic() + seconds
+            if resume_at > self.paused_until:
+                self.paused_until = resume_at
+                self.tokens = 0
+                self.updated_at = resume_at
+
+
+class RequestScheduler:
+    """
+    Sends every request through a token bucket for its host, so concurrent fetchers share the rate limit.
+    Rate limited (429) responses pause the whole host for their Retry-After, and server errors are retried
+    with jittered exponential backoff. Retries are drawn from a budget shared by all threads.
+    """
+
+    # Requests per second and burst size, by host prefix
+    RateLimits: Dict[str, Tuple[float, int]] = {
+        'pd.': (10.0, 10),
+        'glz-': (10.0, 10),
+    }
+    DefaultRateLimit: Tuple[float, int] = (20.0, 20)
+    MaxAttempts: int = 6
+    BaseBackoff: float = 0.5
+    MaxBackoff: float = 30.0
+    # Retries per second and burst size shared between all requests
+    RetryBudget: Tuple[float, int] = (1.0, 20)
+
+    def __init__(self, rate_limits: Optional[Dict[str, Tuple[float, int]]] = None):
+        self.rate_limits: Dict[str, Tuple[float, int]] = RequestScheduler.RateLimits \
+            if rate_limits is None else rate_limits
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.buckets_lock: threading.Lock = threading.Lock()
+        self.retry_budget: TokenBucket = TokenBucket(*RequestScheduler.RetryBudget)
+
+    def _get_bucket(self, host: str) -> TokenBucket:
+        with self.buckets_lock:
+            bucket: Optional[TokenBucket] = self.buckets.get(host, None)
+            if bucket is None:
+                rate, capacity = next((limit for prefix, limit in self.rate_limits.items() if host.startswith(prefix)),
+                                      RequestScheduler.DefaultRateLimit)
+                bucket = self.buckets[host] = TokenBucket(rate, capacity)
+            return bucket
+
+    @staticmethod
+    def _get_retry_after(response: r.Response) -> Optional[float]:
+        value: Optional[str] = response.headers.get('Retry-After', None)
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(tz=timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(RequestScheduler.MaxBackoff, RequestScheduler.BaseBackoff * 2 ** attempt))
+
+    def request(self, session: r.Session, method: str, url: str, max_attempts: Optional[int] = None,
+                **kwargs) -> r.Response:
+        """
+        Send a request, retrying it while the server is rate limiting or failing.
+        :param max_attempts: overrides RequestScheduler.MaxAttempts
+        :raises ApiRequestError: if the request failed and cannot be retried
+        """
+        max_attempts = RequestScheduler.MaxAttempts if max_attempts is None else max(1, max_attempts)
+        bucket: TokenBucket = self._get_bucket(parse.urlsplit(url).netloc)
+        for attempt in range(max_attempts):
+            bucket.acquire()
+            try:
+                response: r.Response = session.request(method, url, **kwargs)
+            except (r.ConnectionError, r.Timeout) as e:
+                error, delay = ApiRequestError(f'{method} {url} failed: {str(e)}'), self._backoff(attempt)
+            else:
+                if response.status_code < 400:
+                    return response
+                error = ApiRequestError(f'{method} {url} returned {response.status_code}', response.status_code)
+                if response.status_code == 429:
+                    delay = self._get_retry_after(response)
+                    if delay is None:
+                        delay = self._backoff(attempt)
+                    logger.warning(f'Rate limited by {parse.urlsplit(url).netloc}, pausing for {delay:.1f}s')
+                    bucket.pause(delay)
+                    delay = 0.0
+                elif response.status_code >= 500:
+                    delay = self._backoff(attempt)
+                else:
+                    raise error
+            if attempt + 1 == max_attempts or not self.retry_budget.try_acquire():
+                raise error
+            logger.debug(f'{str(error)}, retrying (attempt {attempt + 2}/{max_attempts})')
+            time.sleep(delay)
+        raise ApiRequestError(f'{method} {url} failed')
+
+
+class SSLAdapter(HTTPAdapter):
+    """
+    Transport adapter that pins connections to TLS 1.2.
+    """
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self.poolmanager = PoolManager(num_pools=connections,
+                                       maxsize=maxsize,
+                                       block=block,
+                                       ssl_version=ssl.PROTOCOL_TLSv1_2,
+                                       **pool_kwargs)
+
+
 class ValorantAPI:
 
     UUID = str
@@ -139,14 +313,84 @@ class ValorantAPI:
     INITIAL_AUTH_URL: str = 'https://auth.riotgames.com/api/v1/authorization'
     REAUTH_URL: str = 'https://auth.riotgames.com/authorize?redirect_uri=https%3A%2F%2Fplayvalorant.com%2Fopt_in&client_id=play-valorant-web-prod&response_type=token%20id_token&nonce=1'
     ENTITLEMENTS_URL: str = 'https://entitlements.auth.riotgames.com/api/token/v1'
+    VALORANT_API_URL: str = 'https://valorant-api.com'
+    # Seconds a valorant-api.com response is used before revalidating it, by endpoint prefix
+    VALORANT_API_TTLS: Dict[str, int] = {
+        '/v1/version': 60 * 60,
+        '/v1/seasons': 24 * 60 * 60,
+        '/v1/weapons': 24 * 60 * 60,
+        '/v1/maps': 24 * 60 * 60,
+    }
+    VALORANT_API_DEFAULT_TTL: int = 60 * 60
+    VALORANT_API_TIMEOUT: float = 5.0
+
+    # Seconds before expiry at which auth tokens are refreshed
+    TokenRefreshMargin: int = 5 * 60
+    # Assumed lifetime of tokens whose expiry can't be read
+    DefaultTokenLifetime: int = 55 * 60
 
-    def __init__(self, region: str):
+    DefaultPoolSize: int = 8
+    HistoryPageSize: int = 10
+    # Connect and read timeouts in seconds, so a stalled connection fails and is retried instead of hanging
+    RequestTimeout: Tuple[float, float] = (5.0, 30.0)
+
+    def __init__(self, region: str, pool_size: int = DefaultPoolSize):
         self.version: Optional[str] = None
         self.lockfile_contents: Optional[Dict[str, str]] = None
         self.cookies_contents: Optional[ValorantAPI.Cookies] = None
         self.region: str = self.get_region(region.upper())
         self.shard: str = self.get_shard(region.upper())
         self.cached_headers: Optional[ValorantAPI.Headers] = None
+        # Replaces the PD server of the shard, e.g. to point at a local stand-in server
+        self.pd_url_override: Optional[str] = None
+
+        self.pool_size: int = max(1, pool_size)
+        self.sessions: Dict[str, r.Session] = {}
+        self.sessions_lock: threading.Lock = threading.Lock()
+        self.scheduler: RequestScheduler = RequestScheduler()
+        self.cache: ResponseCache = ResponseCache(FileManager.get_storage_path('cache'))
+
+        self.auth_lock: threading.RLock = threading.RLock()
+        self.auth_puuid: Optional[str] = None
+        self.auth_expires_at: Optional[float] = None
+        self.refresh_timer: Optional[threading.Timer] = None
+
+    def _get_session(self, url: str) -> r.Session:
+        """
+        Get the keep-alive session for the host of a URL, creating it on first use.
+        Sessions hold up to pool_size connections and block further requests until one is free,
+        so they can be shared by all the fetching threads.
+        """
+        split_url = parse.urlsplit(url)
+        origin: str = f'{split_url.scheme}://{split_url.netloc}'
+        with self.sessions_lock:
+            session: Optional[r.Session] = self.sessions.get(origin, None)
+            if session is None:
+                session = r.Session()
+                session.mount(origin, SSLAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True))
+                self.sessions[origin] = session
+            return session
+
+    def map_concurrently(self, func: Callable[[T], R], items: Iterable[T]) -> List[R]:
+        """
+        Call func on every item using up to pool_size threads.
+        :return: the results, in the same order as items
+        """
+        items = list(items)
+        if len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.pool_size, len(items))) as executor:
+            return list(executor.map(func, items))
+
+    def close(self):
+        with self.auth_lock:
+            if self.refresh_timer is not None:
+                self.refresh_timer.cancel()
+                self.refresh_timer = None
+        with self.sessions_lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
 
     def _fill_headers(self, headers: Optional[Headers]):
         if headers is None:
@@ -156,6 +400,11 @@ class ValorantAPI:
                 return self.cached_headers
         return headers
 
+    def get_pd_url(self) -> str:
+        if self.pd_url_override is not None:
+            return self.pd_url_override
+        return f'https://pd.{self.shard}.a.pvp.net'
+
     def set_region_and_shard(self, region: str):
         self.region = self.get_region(region)
         self.shard = self.get_shard(region)
@@ -232,12 +481,6 @@ class ValorantAPI:
 
     def _auth_with_cookies(self, force: bool, cache_headers: bool):
         try:
-            class SSLAdapter(HTTPAdapter):
-                def init_poolmanager(self, connections, maxsize, block=False):
-                    self.poolmanager = PoolManager(num_pools=connections,
-                                                   maxsize=maxsize,
-                                                   block=block,
-                                                   ssl_version=ssl.PROTOCOL_TLSv1_2)
             cookies = self.get_cookies(force=force)
             session = r.Session()
 
@@ -294,16 +537,22 @@ class ValorantAPI:
             logger.error(traceback.format_exc())
             return None, None
 
+    @staticmethod
+    def _get_local_entitlements(lockfile: Dict[str, str]) -> Dict:
+        """
+        :return: the tokens of the signed in account, from the local API of the Riot Client
+        """
+        headers = {
+            'Authorization': 'Basic ' + base64.b64encode(('riot:' + lockfile['password']).encode()).decode()
+        }
+        response = r.get(f"https://127.0.0.1:{lockfile['port']}/entitlements/v1/token",
+                         headers=headers, verify=False)
+        return response.json()
+
     def _auth_with_lockfile(self, force: bool, cache_headers: bool) -> Optional[Tuple[UUID, Headers]]:
         try:
             lockfile = self.get_lockfile(force=force)
-            headers = {
-                'Authorization': 'Basic ' + base64.b64encode(('riot:' + lockfile['password']).encode()).decode()
-            }
-
-            response = r.get(f"https://127.0.0.1:{lockfile['port']}/entitlements/v1/token",
-                             headers=headers, verify=False)
-            entitlements = response.json()
+            entitlements = self._get_local_entitlements(lockfile)
             payload = self._build_header(bearer_token=entitlements['accessToken'],
                                          entitlement_token=entitlements['token'])
             if cache_headers:
@@ -314,44 +563,205 @@ class ValorantAPI:
             logger.error(traceback.format_exc())
             return None, None
 
+    @staticmethod
+    def get_token_expiry(token: str) -> Optional[float]:
+        """
+        :return: the expiry (POSIX time) stored in a JWT, or None if it can't be read
+        """
+        try:
+            payload: str = token.split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+        except (IndexError, ValueError, KeyError, TypeError):
+            return None
+
+    @staticmethod
+    def get_tokens_path() -> str:
+        return FileManager.get_storage_path('auth.json')
+
+    def get_signed_in_puuid(self) -> Optional[UUID]:
+        """
+        :return: the PUUID of the account currently signed into the Riot Client, from its session cookies or else its
+                 local API, or None if neither can be read
+        """
+        for cookie in self.get_cookies(force=True) or []:
+            if cookie['name'] == 'sub':
+                return cookie['value']
+        lockfile = self.get_lockfile(force=True)
+        if lockfile is None:
+            return None
+        try:
+            return self._get_local_entitlements(lockfile)['subject']
+        except Exception as e:
+            logger.error(f'Could not get the signed in account: {str(e)}')
+            logger.error(traceback.format_exc())
+            return None
+
+    def _has_valid_tokens(self) -> bool:
+        return self.cached_headers is not None and self.auth_puuid is not None and \
+            self.auth_expires_at is not None and \
+            time.time() < self.auth_expires_at - ValorantAPI.TokenRefreshMargin
+
+    def _load_tokens(self):
+        try:
+            with open(ValorantAPI.get_tokens_path(), 'r') as f:
+                tokens: Dict = json.loads(f.read())
+            if time.time() >= tokens['expires_at'] - ValorantAPI.TokenRefreshMargin:
+                return
+            self.cached_headers = self._build_header(bearer_token=tokens['bearer_token'],
+                                                     entitlement_token=tokens['entitlement_token'])
+            self.auth_puuid = tokens['puuid']
+            self.auth_expires_at = tokens['expires_at']
+            self._schedule_refresh()
+            logger.debug('Loaded stored auth tokens')
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f'Could not load stored auth tokens: {str(e)}')
+            logger.error(traceback.format_exc())
+
+    def _remember_tokens(self, puuid: UUID, headers: Headers):
+        bearer_token: str = headers['Authorization'][len('Bearer '):]
+        entitlement_token: str = headers['X-Riot-Entitlements-JWT']
+        expiries: List[float] = [expiry for expiry in map(self.get_token_expiry, (bearer_token, entitlement_token))
+                                 if expiry is not None]
+        self.auth_puuid = puuid
+        self.auth_expires_at = min(expiries) if expiries else time.time() + ValorantAPI.DefaultTokenLifetime
+        self._schedule_refresh()
+        try:
+            with open(ValorantAPI.get_tokens_path(), 'w') as f:
+                f.write(json.dumps({'puuid': puuid, 'bearer_token': bearer_token,
+                                    'entitlement_token': entitlement_token, 'expires_at': self.auth_expires_at}))
+        except Exception as e:
+            logger.error(f'Could not store auth tokens: {str(e)}')
+            logger.error(traceback.format_exc())
+
+    def _schedule_refresh(self):
+        if self.refresh_timer is not None:
+            self.refresh_timer.cancel()
+        delay: float = max(0.0, self.auth_expires_at - ValorantAPI.TokenRefreshMargin - time.time())
+        self.refresh_timer = threading.Timer(delay, self._refresh_tokens)
+        self.refresh_timer.daemon = True
+        self.refresh_timer.start()
+
+    def _refresh_tokens(self):
+        logger.debug('Auth tokens are about to expire, refreshing...')
+        puuid, _ = self.get_auth(force=True, cache_headers=True)
+        if puuid is None:
+            logger.warning('Could not refresh auth tokens')
+
     def get_auth(self, force: bool = False, cache_headers: bool = True) -> Optional[Tuple[UUID, Headers]]:
-        # Try the cookies method first, then the lockfile method
-        puuid, headers = self._auth_with_cookies(force, cache_headers)
-        if puuid is None or headers is None:
-            return self._auth_with_lockfile(force, cache_headers)
-        return puuid, headers
+        """
+        :param force: authenticate again even if the current tokens are still valid
+        """
+        with self.auth_lock:
+            if not force:
+                if self.auth_expires_at is None:
+                    self._load_tokens()
+                if self._has_valid_tokens():
+                    # The stored tokens outlive restarts, so make sure they belong to the account signed in now.
+                    # Without either local source they can't be checked, and are used as they are
+                    signed_in_puuid: Optional[UUID] = self.get_signed_in_puuid()
+                    if signed_in_puuid is None or signed_in_puuid == self.auth_puuid:
+                        return self.auth_puuid, self.cached_headers
+                    logger.info('Signed in with another account, authenticating again...')
+            # Try the cookies method first, then the lockfile method
+            puuid, headers = self._auth_with_cookies(force, cache_headers)
+            if puuid is None or headers is None:
+                puuid, headers = self._auth_with_lockfile(force, cache_headers)
+            if puuid is not None and headers is not None and cache_headers:
+                self._remember_tokens(puuid, headers)
+            return puuid, headers
+
+    def reauthenticate(self, rejected_headers: Headers):
+        """
+        Authenticate again after the server rejected the cached headers.
+        Threads that were rejected with the same headers wait for a single re-auth instead of each doing their own.
+        :raises ApiRequestError: if authentication failed
+        """
+        with self.auth_lock:
+            if self.cached_headers is not rejected_headers:
+                return
+            logger.warning('Auth tokens were rejected, authenticating again...')
+            puuid, _ = self.get_auth(force=True, cache_headers=True)
+            if puuid is None:
+                raise ApiRequestError('Could not authenticate again', 401)
+
+    def _send(self, method: str, url: str, headers: Optional[Headers], **kwargs) -> r.Response:
+        request_headers: ValorantAPI.Headers = self._fill_headers(headers)
+        try:
+            return self._request(method, url, headers=request_headers, **kwargs)
+        except ApiRequestError as e:
+            # Only the cached headers can be refreshed
+            if e.status_code != 401 or headers is not None:
+                raise
+        self.reauthenticate(request_headers)
+        return self._request(method, url, headers=self._fill_headers(None), **kwargs)
+
+    def _request(self, method: str, url: str, max_attempts: Optional[int] = None, **kwargs) -> r.Response:
+        kwargs.setdefault('timeout', ValorantAPI.RequestTimeout)
+        return self.scheduler.request(self._get_session(url), method, url, max_attempts=max_attempts, **kwargs)
 
     def get(self, url: str, params: Optional[Dict] = None, headers: Optional[Headers] = None) -> Dict:
-        response = r.get(url, headers=self._fill_headers(headers), params=params)
+        response = self._send('GET', url, headers, params=params)
         return json.loads(response.text)
 
     def get_pd(self, endpoint: str, params: Optional[Dict] = None, headers: Optional[Headers] = None) -> Dict:
-        return self.get(f'https://pd.{self.shard}.a.pvp.net{endpoint}', params, headers)
+        return self.get(f'{self.get_pd_url()}{endpoint}', params, headers)
 
     def get_glz(self, endpoint: str, params: Optional[Dict] = None, headers: Optional[Headers] = None) -> Dict:
         return self.get(f'https://glz-{self.region}-1.{self.shard}.a.pvp.net{endpoint}', params, headers)
 
     def post(self, url: str, data: Optional[Dict] = None, headers: Optional[Headers] = None) -> Dict:
-        response = r.post(url, headers=self._fill_headers(headers), data=data)
+        response = self._send('POST', url, headers, data=data)
         return json.loads(response.text)
 
     def post_pd(self, endpoint: str, data: Optional[Dict] = None, headers: Optional[Headers] = None) -> Dict:
-        return self.post(f'https://pd.{self.shard}.a.pvp.net{endpoint}', data, headers)
+        return self.post(f'{self.get_pd_url()}{endpoint}', data, headers)
 
     def post_glz(self, endpoint: str, data: Optional[Dict] = None, headers: Optional[Headers] = None) -> Dict:
         return self.post(f'https://glz-{self.region}-1.{self.shard}.a.pvp.net{endpoint}', data, headers)
 
     def put(self, url: str, data: Optional[Union[Dict, str]] = None, headers: Optional[Headers] = None) -> Dict:
-        response = r.put(url, headers=self._fill_headers(headers), data=data)
+        response = self._send('PUT', url, headers, data=data)
         return json.loads(response.text)
 
     def put_pd(self, endpoint: str, data: Optional[Union[Dict, str]] = None, headers: Optional[Headers] = None) -> Dict:
-        return self.put(f'https://pd.{self.shard}.a.pvp.net{endpoint}', headers=headers, data=data)
-
-    @staticmethod
-    def get_valorant_api(endpoint: str) -> Optional[Dict]:
-        data = r.get(f'https://valorant-api.com{endpoint}')
-        return data.json().get('data', None)
+        return self.put(f'{self.get_pd_url()}{endpoint}', headers=headers, data=data)
+
+    def get_valorant_api(self, endpoint: str) -> Optional[Dict]:
+        """
+        Get data from valorant-api.com, going through the on-disk cache.
+        Fresh entries are returned without a request, older ones are revalidated, and stale data is
+        used if valorant-api.com cannot be reached.
+        """
+        ttl: int = next((ttl for prefix, ttl in ValorantAPI.VALORANT_API_TTLS.items() if endpoint.startswith(prefix)),
+                        ValorantAPI.VALORANT_API_DEFAULT_TTL)
+        cached: Optional[CachedResponse] = self.cache.load(endpoint)
+        if cached is not None and cached.get_age() < ttl:
+            return cached.data
+
+        url: str = f'{ValorantAPI.VALORANT_API_URL}{endpoint}'
+        try:
+            # With stale data to fall back on, don't hold up the caller with retries
+            response = self._request('GET', url, headers={} if cached is None else cached.get_validators(),
+                                     max_attempts=None if cached is None else 1,
+                                     timeout=ValorantAPI.VALORANT_API_TIMEOUT)
+        except ApiRequestError as e:
+            if cached is None:
+                raise
+            logger.warning(f'Using stale data for {endpoint}: {str(e)}')
+            return cached.data
+
+        if response.status_code == 304 and cached is not None:
+            cached.fetched_at = time.time()
+            self.cache.store(endpoint, cached)
+            return cached.data
+        data = response.json().get('data', None)
+        if data is not None:
+            self.cache.store(endpoint, CachedResponse(data, time.time(), response.headers.get('ETag', None),
+                                                      response.headers.get('Last-Modified', None)))
+        return data
 
     def get_current_version(self, force: bool = False) -> Optional[str]:
         if self.version is not None and not force:
@@ -412,31 +822,72 @@ class ValorantAPI:
     def get_party_members(self, party_id: str):
         return self.get_glz(f'/parties/v1/parties/{party_id}').get('Members', None)
 
+    @staticmethod
+    def dedupe_match_history(history: Iterable[Dict]) -> List[Dict]:
+        """
+        Drop repeated match history entries, keeping the first occurrence of every MatchID.
+        Pages fetched while a new game finishes can overlap, since the history shifts by one.
+        """
+        seen_match_ids = set()
+        unique_history: List[Dict] = []
+        for entry in history:
+            if entry['MatchID'] not in seen_match_ids:
+                seen_match_ids.add(entry['MatchID'])
+                unique_history.append(entry)
+        return unique_history
+
     def get_match_history_info(self, puuid: str, start_index: int, end_index: int, queue: Optional[str] = None):
-        def request(new_start: int, new_end: int):
+        def request(page: Tuple[int, int]):
+            new_start, new_end = page
             data = {'startIndex': new_start, 'endIndex': new_end, 'queue': '' if queue is None else queue}
             return self.get_pd(f'/match-history/v1/history/{puuid}', data)
-        if end_index - start_index > 10:
+        if end_index - start_index > ValorantAPI.HistoryPageSize:
+            # Every page range is known up front, so request them all at once
+            pages: List[Tuple[int, int]] = [(i, min(i + ValorantAPI.HistoryPageSize, end_index))
+                                            for i in range(start_index, end_index, ValorantAPI.HistoryPageSize)]
             matches: List[Dict] = []
             total_count: int = 0
-            for i in range(start_index, end_index, 10):
-                match_info: Dict = request(i, i + 10)
-                total_count = match_info.get('Total', 0)
+            for match_info in self.map_concurrently(request, pages):
+                total_count = max(total_count, match_info.get('Total', 0))
                 matches.extend(match_info.get('History', []))
-            return {'BeginIndex': start_index, 'EndIndex': end_index, 'History': matches,
+            return {'BeginIndex': start_index, 'EndIndex': end_index, 'History': self.dedupe_match_history(matches),
                     'Subject': puuid, 'Total': total_count}
         else:
-            return request(start_index, end_index)
+            return request((start_index, end_index))
 
     def get_all_match_history(self, puuid: str, queue: Optional[str] = None):
-        first_20_matches = self.get_match_history_info(puuid, start_index=0, end_index=20, queue=queue)
-        total_matches_available: int = first_20_matches['Total']
-        if total_matches_available > 20:
-            remaining_matches = self.get_match_history_info(puuid, start_index=20, end_index=total_matches_available,
-                                                            queue=queue)
-            first_20_matches['History'].extend(remaining_matches['History'])
-            first_20_matches['EndIndex'] = total_matches_available
-        return first_20_matches
+        first_page = self.get_match_history_info(puuid, start_index=0, end_index=ValorantAPI.HistoryPageSize,
+                                                 queue=queue)
+        first_page['History'] = first_page.get('History', [])
+        total_matches_available: int = first_page.get('Total', 0)
+        if total_matches_available > ValorantAPI.HistoryPageSize:
+            remaining_matches = self.get_match_history_info(puuid, start_index=ValorantAPI.HistoryPageSize,
+                                                            end_index=total_matches_available, queue=queue)
+            first_page['History'] = self.dedupe_match_history(first_page['History'] + remaining_matches['History'])
+            first_page['EndIndex'] = total_matches_available
+        return first_page
+
+    def get_new_match_history(self, puuid: str, is_known: Callable[[Dict], bool], queue: Optional[str] = None):
+        """
+        Page through the match history from the newest match, stopping at the first page where every match is known.
+        The history is sorted newest first, so everything after that page has been seen before.
+        :param is_known: whether a match history entry was already synced
+        """
+        matches: List[Dict] = []
+        total_count: int = 0
+        start_index: int = 0
+        while True:
+            match_info: Dict = self.get_match_history_info(puuid, start_index=start_index,
+                                                           end_index=start_index + ValorantAPI.HistoryPageSize,
+                                                           queue=queue)
+            page: List[Dict] = match_info.get('History', [])
+            total_count = match_info.get('Total', 0)
+            matches.extend(page)
+            start_index += ValorantAPI.HistoryPageSize
+            if not page or start_index >= total_count or all(is_known(entry) for entry in page):
+                break
+        return {'BeginIndex': 0, 'EndIndex': start_index, 'History': self.dedupe_match_history(matches),
+                'Subject': puuid, 'Total': total_count}
 
     def get_match_info(self, match_id: str):
         return self.get_pd(f'/match-details/v1/matches/{match_id}')
@@ -0,0 +1,76 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import traceback
+from typing import Optional, Dict, Any
+
+from src.utils import logger
+
+
+class CachedResponse:
+
+    def __init__(self, data: Any, fetched_at: float, etag: Optional[str] = None,
+                 last_modified: Optional[str] = None):
+        self.data: Any = data
+        self.fetched_at: float = fetched_at
+        self.etag: Optional[str] = etag
+        self.last_modified: Optional[str] = last_modified
+
+    def get_age(self) -> float:
+        return time.time() - self.fetched_at
+
+    def get_validators(self) -> Dict[str, str]:
+        """
+        Headers that make a request conditional on the response having changed.
+        """
+        headers: Dict[str, str] = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def to_dict(self) -> Dict:
+        return {'data': self.data, 'fetched_at': self.fetched_at, 'etag': self.etag,
+                'last_modified': self.last_modified}
+
+
+class ResponseCache:
+    """
+    Stores JSON responses on disk, one file per key, so they survive restarts.
+    """
+
+    def __init__(self, directory: str):
+        self.directory: str = directory
+        self.lock: threading.Lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def load(self, key: str) -> Optional[CachedResponse]:
+        try:
+            with open(self._get_path(key), 'r') as f:
+                entry: Dict = json.loads(f.read())
+            return CachedResponse(entry['data'], entry['fetched_at'], entry.get('etag', None),
+                                  entry.get('last_modified', None))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f'Could not read cached response for {key}: {str(e)}')
+            logger.error(traceback.format_exc())
+            return None
+
+    def store(self, key: str, response: CachedResponse):
+        path: str = self._get_path(key)
+        try:
+            with self.lock:
+                # Write to a temporary file first so a crash never leaves a truncated entry behind
+                with open(path + '.tmp', 'w') as f:
+                    f.write(json.dumps(response.to_dict()))
+                os.replace(path + '.tmp', path)
+        except Exception as e:
+            logger.error(f'Could not cache response for {key}: {str(e)}')
+            logger.error(traceback.format_exc())
@@ -1,5 +1,6 @@
 import os
 import sys
+import multiprocessing
 from src.utils import FileManager
 
 from PySide2.QtGui import *
@@ -7,7 +8,7 @@ from PySide2.QtWidgets import *
 
 from src.ui.views.main_view import MainView
 from src.ui.controllers.main_controller import MainController
-from src.utils import logger
+from src.utils import logger, init_file_logging
 
 
 class App(QApplication):
@@ -32,6 +33,9 @@ class App(QApplication):
 
 
 if __name__ == '__main__':
+    # Re-analysis worker processes of the bundled executable start here too
+    multiprocessing.freeze_support()
+
     # Set working directory with PyInstaller
     try:
         # If the application is run as a bundle, the PyInstaller bootloader
@@ -43,6 +47,8 @@ if __name__ == '__main__':
     os.chdir(wd)
 
     files_migrated: int = FileManager.migrate_files(['matches.db', 'settings.ini', 'storage.json', 'debug.log'])
+    # After freeze_support, which never returns in worker processes, so only this process writes debug.log
+    init_file_logging()
 
     logger.debug(f"{files_migrated} files migrated.")
 
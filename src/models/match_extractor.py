@@ -0,0 +1,144 @@
+import json
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from src.utils import logger
+
+# Plant time of rounds without a plant, later than any kill
+NoPlantRoundTime: int = 1000000
+
+_decoder = json.JSONDecoder()
+_top_level_key = re.compile(r'\s*[{,]\s*"([^"\\]*)"\s*:\s*')
+_end_of_document = re.compile(r'\s*}\s*$')
+_kills_key = re.compile(r',\s*"kills"\s*:\s*')
+_integer_value = re.compile(r'\s*:\s*(-?\d+)')
+
+
+class MatchDetails(NamedTuple):
+    """
+    The parts of the match details needed to analyze a match.
+    """
+    map_id: str
+    player_teams: Dict[str, str]
+    plant_round_times: List[int]
+    kills: List[Dict]
+
+
+def extract_map_id(match_info: Union[str, Dict]) -> str:
+    """
+    Get the map ID out of the match details, decoding only the matchInfo object that comes first.
+    """
+    if isinstance(match_info, dict):
+        return match_info['matchInfo']['mapId']
+    try:
+        header, _ = _decode_header(match_info, stop_key='players')
+        return header['matchInfo']['mapId']
+    except (ValueError, KeyError, TypeError) as e:
+        logger.debug(f'Could not extract the map ID, parsing the whole match: {str(e)}')
+        return json.loads(match_info)['matchInfo']['mapId']
+
+
+def extract_match_details(match_info: Union[str, Dict]) -> MatchDetails:
+    """
+    Get the parts of the match details needed for analysis. Only the small objects at the start of the document
+    and the kills at its end are decoded; the round results, which hold the loadouts, damage and economy of every
+    player, are only scanned for their plant times. Documents laid out differently are parsed whole.
+    """
+    if isinstance(match_info, dict):
+        return _details_from_dict(match_info)
+    try:
+        return _extract_details(match_info)
+    except (ValueError, KeyError, TypeError) as e:
+        logger.debug(f'Could not extract match details, parsing the whole match: {str(e)}')
+        return _details_from_dict(json.loads(match_info))
+
+
+def _details_from_dict(match_info: Dict) -> MatchDetails:
+    return MatchDetails(map_id=match_info['matchInfo']['mapId'],
+                        player_teams={player['subject']: player['teamId'] for player in match_info['players']},
+                        plant_round_times=[game_round.get('plantRoundTime', NoPlantRoundTime)
+                                           for game_round in match_info['roundResults']],
+                        kills=match_info['kills'])
+
+
+def _decode_header(text: str, stop_key: str) -> Tuple[Dict, int]:
+    """
+    Decode the top level values of the document in order, up to stop_key.
+    :return: the decoded values by key and the offset of the value of stop_key
+    """
+    header: Dict = {}
+    index: int = 0
+    while (key_match := _top_level_key.match(text, index)) is not None:
+        key: str = key_match.group(1)
+        if key == stop_key:
+            return header, key_match.end()
+        header[key], index = _decoder.raw_decode(text, key_match.end())
+    raise ValueError(f'No top level {stop_key} key at offset {index}')
+
+
+def _find_kills(text: str, start: int) -> Tuple[List[Dict], int]:
+    """
+    Decode the kills, which are the last top level value of the document.
+    :return: the kills and the offset of their key
+    """
+    # Kill events have no kills key of their own, so the last one in the document is the one of the kills
+    key_offset: int = text.rfind('"kills"')
+    comma_offset: int = text.rfind(',', start, key_offset)
+    key_match: Optional[re.Match] = _kills_key.match(text, comma_offset) if comma_offset >= start else None
+    if key_match is None or key_match.end() <= key_offset:
+        raise ValueError('Kills are not the last top level value')
+    kills, end = _decoder.raw_decode(text, key_match.end())
+    if not isinstance(kills, list) or _end_of_document.match(text, end) is None:
+        raise ValueError('Kills are not the last top level value')
+    return kills, key_match.start()
+
+
+def _extract_plant_round_times(text: str, start: int, end: int) -> List[int]:
+    """
+    Pick the plant time of every round out of the round results between start and end, without decoding them.
+    Every round has to have exactly one roundNum followed by exactly one plantRoundTime, in order.
+    """
+    # str.find skips ahead much faster than a regex that has to try every quote
+    fields: List[Tuple[int, str]] = []
+    for field in ('roundNum', 'plantRoundTime'):
+        key: str = f'"{field}"'
+        offset: int = text.find(key, start, end)
+        while offset != -1:
+            fields.append((offset + len(key), field))
+            offset = text.find(key, offset + len(key), end)
+    fields.sort()
+
+    plant_round_times: List[Optional[int]] = []
+    for offset, field in fields:
+        value_match: Optional[re.Match] = _integer_value.match(text, offset, end)
+        if value_match is None:
+            raise ValueError(f'{field} is not an integer')
+        value: int = int(value_match.group(1))
+        if field == 'roundNum':
+            if value != len(plant_round_times):
+                raise ValueError(f'Unexpected round number {value}')
+            plant_round_times.append(None)
+        elif not plant_round_times or plant_round_times[-1] is not None:
+            raise ValueError('Plant time outside of a round')
+        else:
+            plant_round_times[-1] = value
+    if None in plant_round_times:
+        raise ValueError('Round without a plant time')
+    return plant_round_times
+
+
+def _extract_details(text: str) -> MatchDetails:
+    header, rounds_start = _decode_header(text, stop_key='roundResults')
+    kills, kills_key_offset = _find_kills(text, rounds_start)
+    rounds_end: int = kills_key_offset
+    while rounds_end > rounds_start and text[rounds_end - 1].isspace():
+        rounds_end -= 1
+    if text[rounds_start:rounds_start + 1] != '[' or text[rounds_end - 1:rounds_end] != ']':
+        raise ValueError('Round results are not followed by the kills')
+    plant_round_times: List[int] = _extract_plant_round_times(text, rounds_start, kills_key_offset)
+    if any(kill.get('round', -1) >= len(plant_round_times) for kill in kills):
+        raise ValueError('Kill in an unknown round')
+    return MatchDetails(map_id=header['matchInfo']['mapId'],
+                        player_teams={player['subject']: player['teamId'] for player in header['players']},
+                        plant_round_times=plant_round_times,
+                        kills=kills)
@@ -3,21 +3,36 @@ from PySide2.QtCore import QObject, Signal
 from datetime import datetime
 import json
 import math
+import struct
+import threading
+import zlib
 from typing import Iterator, Tuple, Dict, List, Optional, Union
 
-from shapely.geometry import Point, Polygon
+import numpy as np
+from shapely.geometry import Point, Polygon, box
+from shapely.prepared import prep
+from shapely.strtree import STRtree
 
+from src.models.match_extractor import MatchDetails, extract_map_id, extract_match_details
 from src.utils import logger
 
 
+Sides = ('attacker', 'defender')
+PlantTimes = ('preplant', 'postplant')
+# Roles of the player in a kill event: 'k' for the killer, 'v' for the victim
+Roles = ('k', 'v')
+
+
 class MapZone:
 
     def __init__(self, name: str, polygon: Polygon):
         self.name = name
         self.polygon = polygon
+        # Prepared once, so repeated contains tests don't redo the geometry setup
+        self.prepared_polygon = prep(polygon)
 
     def contains(self, point: Point) -> bool:
-        return self.polygon.contains(point)
+        return self.prepared_polygon.contains(point)
 
     def get_points(self) -> Iterator[Tuple[float, float]]:
         return zip(*self.polygon.exterior.coords.xy)
@@ -43,6 +58,12 @@ class MapZone:
 
 class GameMap:
 
+    # Side length in pixels of the zone raster, which covers normalized map space (0 to 1 on both axes)
+    RasterSize: int = 2048
+    # Raster labels other than zone ordinals
+    RasterNoZone: int = 255
+    RasterBoundary: int = 254
+
     def __init__(self, map_metadata: Dict):
         self.map_metadata: Dict = map_metadata
 
@@ -58,25 +79,236 @@ class GameMap:
             name: str = zone['name']
             polygon = Polygon(map(lambda p: (p['x'], 1-p['y']), zone['points'])) #the files are stored with the zone  y's at 1-y so we need to reverse it back
             self.zones[name] = MapZone(name, polygon)
+        # Ordinal of every zone, in the order of the map metadata
+        self.zone_ordinals: Dict[str, int] = {name: ordinal for ordinal, name in enumerate(self.zones)}
+        # Changes whenever the zones are renamed, reordered or reshaped, which invalidates stats computed before
+        self.zone_hash: int = zlib.crc32(json.dumps([[zone['name'], zone['points']]
+                                                     for zone in self.map_metadata['zones']]).encode('utf-8'))
+        self.zone_list: List[MapZone] = list(self.zones.values())
+        # Spatial index over the zone polygons, which narrows lookups down to the zones whose bounding boxes match
+        self.zone_tree: STRtree = STRtree([zone.polygon for zone in self.zone_list])
+        self.zone_ordinals_by_polygon: Dict[int, int] = {id(zone.polygon): ordinal
+                                                         for ordinal, zone in enumerate(self.zone_list)}
+        # Built on first use, since most maps are never classified against in a session
+        self.zone_raster: Optional[np.ndarray] = None
+        self.zone_raster_lock: threading.Lock = threading.Lock()
 
     def get_zones(self) -> Dict[str, MapZone]:
         return self.zones
 
-    def get_zone_from_game_coords(self, game_x: int, game_y: int) -> Optional[MapZone]:
-        return self.get_point_zone(Point(*self.normalize_point(game_x, game_y)))
+    def get_zone_raster(self) -> np.ndarray:
+        """
+        :return: the zone ordinal of every pixel of normalized map space by [y][x], RasterNoZone outside of all
+                 zones, or RasterBoundary where a zone edge crosses the pixel and the exact polygons decide
+        """
+        if self.zone_raster is None:
+            with self.zone_raster_lock:
+                if self.zone_raster is None:
+                    self.zone_raster = self._build_zone_raster()
+        return self.zone_raster
+
+    def _build_zone_raster(self) -> np.ndarray:
+        size: int = GameMap.RasterSize
+        raster: np.ndarray = np.full((size, size), GameMap.RasterNoZone, dtype=np.uint8)
+        boundary: np.ndarray = np.zeros((size, size), dtype=bool)
+        pixel_centers: np.ndarray = (np.arange(size) + 0.5) / size
+
+        for ordinal, zone in enumerate(self.zone_list):
+            coords: np.ndarray = np.asarray(zone.polygon.exterior.coords)
+            x0, y0 = coords[:-1].T
+            x1, y1 = coords[1:].T
+
+            # Scanline fill within the bounding box: every edge crossing a row of pixel centers toggles the pixels
+            # to the right of it
+            min_x, min_y, max_x, max_y = zone.polygon.bounds
+            first_row, last_row = (int(np.clip(math.floor(value * size), 0, size))
+                                   for value in (min_y, max_y + 1 / size))
+            first_column, last_column = (int(np.clip(math.floor(value * size), 0, size))
+                                         for value in (min_x, max_x + 1 / size))
+            row_centers: np.ndarray = pixel_centers[first_row:last_row, None]
+            crossing: np.ndarray = (y0 <= row_centers) != (y1 <= row_centers)
+            rows, edges = np.nonzero(crossing)
+            crossing_x: np.ndarray = x0[edges] + (row_centers[rows, 0] - y0[edges]) \
+                * (x1[edges] - x0[edges]) / (y1[edges] - y0[edges])
+            columns: np.ndarray = np.clip(np.ceil(crossing_x * size - 0.5) - first_column, 0,
+                                          last_column - first_column).astype(np.intp)
+            toggles: np.ndarray = np.zeros((last_row - first_row, last_column - first_column + 1), dtype=np.int32)
+            np.add.at(toggles, (rows, columns), 1)
+            inside: np.ndarray = (np.cumsum(toggles, axis=1)[:, :-1] & 1).astype(bool)
+            # The first zone containing a point wins, like in get_point_zone
+            window: np.ndarray = raster[first_row:last_row, first_column:last_column]
+            window[inside & (window == GameMap.RasterNoZone)] = ordinal
+
+            # Mark every pixel an edge passes through, sampled at a quarter pixel
+            for edge in range(len(x0)):
+                samples: int = int(math.hypot(x1[edge] - x0[edge], y1[edge] - y0[edge]) * size * 4) + 2
+                t: np.ndarray = np.linspace(0.0, 1.0, samples)
+                xs = np.clip(((x0[edge] + t * (x1[edge] - x0[edge])) * size).astype(np.intp), 0, size - 1)
+                ys = np.clip(((y0[edge] + t * (y1[edge] - y0[edge])) * size).astype(np.intp), 0, size - 1)
+                boundary[ys, xs] = True
+
+        # Grow the boundary by a pixel, so edges that only clip the corner of a pixel are covered too
+        grown: np.ndarray = boundary.copy()
+        grown[1:, :] |= boundary[:-1, :]
+        grown[:-1, :] |= boundary[1:, :]
+        grown[:, 1:] |= boundary[:, :-1]
+        grown[:, :-1] |= boundary[:, 1:]
+        raster[grown] = GameMap.RasterBoundary
+        return raster
+
+    def get_zone_from_game_coords(self, game_x: int, game_y: int, max_gap_distance: float = 0.0) \
+            -> Optional[MapZone]:
+        """
+        :param max_gap_distance: points outside of all zones are attributed to the nearest zone within this distance,
+                                 in normalized map space
+        """
+        x, y = self.normalize_point(game_x, game_y)
+        column, row = math.floor(x * GameMap.RasterSize), math.floor(y * GameMap.RasterSize)
+        zone: Optional[MapZone] = None
+        if 0 <= column < GameMap.RasterSize and 0 <= row < GameMap.RasterSize:
+            label: int = self.get_zone_raster()[row, column]
+            if label != GameMap.RasterNoZone and label != GameMap.RasterBoundary:
+                return self.zone_list[label]
+            elif label == GameMap.RasterBoundary:
+                zone = self.get_point_zone(Point(x, y))
+        else:
+            zone = self.get_point_zone(Point(x, y))
+        if zone is None and max_gap_distance > 0:
+            zone = self.get_nearest_zone(Point(x, y), max_gap_distance)
+        return zone
+
+    def classify_game_coords(self, game_coords: np.ndarray, max_gap_distance: float = 0.0) -> np.ndarray:
+        """
+        Find the zones of many points at once.
+        :param game_coords: N×2 array of (x, y) game coordinates
+        :param max_gap_distance: points outside of all zones are attributed to the nearest zone within this distance,
+                                 in normalized map space
+        :return: int array of the zone ordinal of every point, -1 for points outside of all zones
+        """
+        game_coords = np.asarray(game_coords, dtype=np.float64).reshape(-1, 2)
+        # Yes swapping the game_x and game_y here, like in normalize_point
+        x: np.ndarray = game_coords[:, 1] * self.scale_x + self.offset_x
+        y: np.ndarray = game_coords[:, 0] * self.scale_y + self.offset_y
+        columns: np.ndarray = np.floor(x * GameMap.RasterSize)
+        rows: np.ndarray = np.floor(y * GameMap.RasterSize)
+        in_raster: np.ndarray = (columns >= 0) & (columns < GameMap.RasterSize) \
+            & (rows >= 0) & (rows < GameMap.RasterSize)
+
+        labels: np.ndarray = np.full(len(game_coords), GameMap.RasterBoundary, dtype=np.intp)
+        labels[in_raster] = self.get_zone_raster()[rows[in_raster].astype(np.intp), columns[in_raster].astype(np.intp)]
+        # Points on zone edges or off the map are tested against the exact polygons
+        for index in np.nonzero(labels == GameMap.RasterBoundary)[0]:
+            zone: Optional[MapZone] = self.get_point_zone(Point(x[index], y[index]))
+            labels[index] = GameMap.RasterNoZone if zone is None else self.zone_ordinals[zone.name]
+        if max_gap_distance > 0:
+            for index in np.nonzero(labels == GameMap.RasterNoZone)[0]:
+                zone: Optional[MapZone] = self.get_nearest_zone(Point(x[index], y[index]), max_gap_distance)
+                if zone is not None:
+                    labels[index] = self.zone_ordinals[zone.name]
+        labels[labels == GameMap.RasterNoZone] = -1
+        return labels
+
+    def _query_zone_ordinals(self, geometry) -> List[int]:
+        """
+        :return: ordinals of the zones whose bounding boxes intersect the one of the geometry, in zone order
+        """
+        candidates = self.zone_tree.query(geometry)
+        # Shapely 2 returns the indices of the matching polygons, Shapely 1 the polygons themselves
+        if isinstance(candidates, np.ndarray) and candidates.dtype.kind in 'iu':
+            return sorted(candidates.tolist())
+        return sorted(self.zone_ordinals_by_polygon[id(polygon)] for polygon in candidates)
 
     def get_point_zone(self, point: Point) -> Optional[MapZone]:
-        for zone in self.zones.values():
+        # The first zone containing the point wins, in the order of the map metadata
+        for ordinal in self._query_zone_ordinals(point):
+            zone: MapZone = self.zone_list[ordinal]
             if zone.contains(point):
                 return zone
         return None
 
+    def get_nearest_zone(self, point: Point, max_distance: float) -> Optional[MapZone]:
+        """
+        Find the zone nearest to a point that fell in a gap between zones. Only the zones with bounding boxes within
+        max_distance are measured, so the cost doesn't grow with the number of zones.
+        :param max_distance: in normalized map space
+        :return: the nearest zone, the first one on ties, or None if no zone is within max_distance
+        """
+        search_area = box(point.x - max_distance, point.y - max_distance,
+                          point.x + max_distance, point.y + max_distance)
+        nearest: Optional[MapZone] = None
+        nearest_distance: float = max_distance
+        for ordinal in self._query_zone_ordinals(search_area):
+            zone: MapZone = self.zone_list[ordinal]
+            distance: float = zone.polygon.distance(point)
+            if distance < nearest_distance or (nearest is None and distance == nearest_distance):
+                nearest, nearest_distance = zone, distance
+        return nearest
+
     def normalize_point(self, game_x: int, game_y: int) -> Tuple[float, float]:
         # Yes swapping the game_x and game_y here, this is correct
         ret = (game_y * self.scale_x + self.offset_x, game_x * self.scale_y + self.offset_y)
         return ret
 
 
+class MatchStats:
+    """
+    Stats of a player in a match: kill and death counts by side, plant time and zone, along with the kill events
+    that can be drawn on the map. Stored in a compact binary form that decodes into NumPy views of the stored bytes.
+
+    Layout (little endian): a header, the counts as int32[side][plant time][zone ordinal][role], then the events.
+    """
+    CodecVersion: int = 1
+    # codec version, stats version, zone count, padding, zone hash
+    Header: struct.Struct = struct.Struct('<HHHxxI')
+    EventDtype: np.dtype = np.dtype([('side', 'u1'), ('plant_time', 'u1'), ('zone', '<u2'), ('role', 'u1'),
+                                     ('killer', '<i4', (2,)), ('victim', '<i4', (2,))])
+
+    def __init__(self, version: int, zone_hash: int, counts: np.ndarray, events: np.ndarray):
+        self.version: int = version
+        self.zone_hash: int = zone_hash
+        self.counts: np.ndarray = counts
+        self.events: np.ndarray = events
+
+    @classmethod
+    def from_events(cls, version: int, game_map: GameMap, events: List[Tuple[int, int, int, int, Tuple, Tuple]]) \
+            -> 'MatchStats':
+        """
+        :param events: (side, plant time, zone ordinal, role, killer position, victim position) of every event of
+                       the player, where the killer position is None if the killer could not be located
+        """
+        counts: np.ndarray = np.zeros((len(Sides), len(PlantTimes), len(game_map.zones), len(Roles)), dtype='<i4')
+        for side, plant_time, zone, role, _, _ in events:
+            counts[side, plant_time, zone, role] += 1
+        located: np.ndarray = np.array([event for event in events if event[4] is not None], dtype=cls.EventDtype)
+        return cls(version, game_map.zone_hash, counts, located)
+
+    def encode(self) -> bytes:
+        zone_count: int = self.counts.shape[2]
+        return self.Header.pack(self.CodecVersion, self.version, zone_count, self.zone_hash) \
+            + self.counts.astype('<i4', copy=False).tobytes() \
+            + self.events.astype(self.EventDtype, copy=False).tobytes()
+
+    @classmethod
+    def decode(cls, data: bytes) -> 'MatchStats':
+        """
+        :raises ValueError: if the data was encoded by an unknown codec version or is truncated
+        """
+        if len(data) < cls.Header.size:
+            raise ValueError('Stats are truncated')
+        codec_version, version, zone_count, zone_hash = cls.Header.unpack_from(data)
+        if codec_version != cls.CodecVersion:
+            raise ValueError(f'Unknown stats codec version {codec_version}')
+        count_size: int = len(Sides) * len(PlantTimes) * zone_count * len(Roles)
+        counts: np.ndarray = np.frombuffer(data, dtype='<i4', count=count_size, offset=cls.Header.size) \
+            .reshape((len(Sides), len(PlantTimes), zone_count, len(Roles)))
+        events: np.ndarray = np.frombuffer(data, dtype=cls.EventDtype, offset=cls.Header.size + counts.nbytes)
+        return cls(version, zone_hash, counts, events)
+
+    def is_current(self, version: int, game_map: GameMap) -> bool:
+        return self.version == version and self.zone_hash == game_map.zone_hash \
+            and self.counts.shape[2] == len(game_map.zones)
+
+
 class Match:
 
     def __init__(self, match_model: Dict):
@@ -92,10 +324,25 @@ class Match:
         self.my_assists: int = match_model['my_assists']
         self.my_score: int = match_model['my_score']
         self.match_info: Optional[Union[str, Dict]] = match_model['raw_json']
+        # Extracted from match_info on first use
+        self.details: Optional[MatchDetails] = None
         self.queue: str = match_model['queue']
-        self.stats: Optional[Dict] = None if match_model['stats'] is None else json.loads(match_model['stats'])
+        self.stats: Optional[MatchStats] = self._decode_stats(match_model['stats'])
         self.map_id: str = match_model['map_id']
 
+    @staticmethod
+    def _decode_stats(stats: Optional[Union[str, bytes, MatchStats]]) -> Optional[MatchStats]:
+        if isinstance(stats, MatchStats):
+            return stats
+        # Stats stored as JSON by older versions are recomputed
+        if stats is None or isinstance(stats, str):
+            return None
+        try:
+            return MatchStats.decode(stats)
+        except ValueError as e:
+            logger.warning(f'Could not decode stats: {str(e)}')
+            return None
+
     # @staticmethod
     # def load_match_from_file(file_path: Union[str, Path]):
     #     with open(file_path, 'r') as f:
@@ -110,21 +357,29 @@ class Match:
     def get_player_team(self) -> str:
         return self.my_team
 
-    def get_rounds(self) -> Optional[List[Dict]]:
-        if isinstance(self.match_info, str):
-            self.match_info = json.loads(self.match_info)
-        return self.match_info['roundResults']
+    def get_details(self) -> MatchDetails:
+        if self.details is None:
+            self.details = extract_match_details(self.match_info)
+        return self.details
+
+    def get_player_teams(self) -> Dict[str, str]:
+        """
+        :return: the team ID of every player in the match, by PUUID
+        """
+        return self.get_details().player_teams
+
+    def get_plant_round_times(self) -> List[int]:
+        """
+        :return: the round time of the spike plant of every round, NoPlantRoundTime for rounds without a plant
+        """
+        return self.get_details().plant_round_times
 
     def get_kills(self) -> Optional[List[Dict]]:
-        if isinstance(self.match_info, str):
-            self.match_info = json.loads(self.match_info)
-        return self.match_info['kills']
+        return self.get_details().kills
 
     def get_map_id(self) -> str:
-        if self.map_id == '':
-            if isinstance(self.match_info, str):
-                self.match_info = json.loads(self.match_info)
-            return self.match_info['matchInfo']['mapId']
+        if not self.map_id:
+            return self.details.map_id if self.details is not None else extract_map_id(self.match_info)
         return self.map_id
 
     def unload_match_info(self):
@@ -132,6 +387,7 @@ class Match:
         Unload match info to save memory. Cannot be reverted.
         """
         self.match_info = None
+        self.details = None
 
 
 class PlayerData(QObject):
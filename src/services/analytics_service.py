@@ -1,22 +1,37 @@
+import os
+import json
 import threading
-from typing import List, Dict, Tuple
+import traceback
+from typing import List, Dict, Tuple, Optional, Set
 
-from src.models.models import Match
+import numpy as np
+
+from src.models.models import Match, MatchStats, GameMap, Sides, PlantTimes, Roles
 from src.services.map_service import MapService
 from src.services.api_service import ApiService
-
-
-Sides = ('attacker', 'defender')
-PlantTimes = ('preplant', 'postplant')
+from src.services.match_service import MatchService
+from src.utils import FileManager, logger
 
 
 class AnalyticsService:
+    """
+    Aggregates the stats of matches by map and queue. The aggregate is saved as a snapshot per player, so it can be
+    shown right after startup and only matches stored since the snapshot need to be added to it.
+    """
+
+    SnapshotVersion: int = 1
 
     def __init__(self, map_service: MapService):
         self.map_service: MapService = map_service
 
         self.stats_mutex: threading.Lock = threading.Lock()
+        # Held while a snapshot is written, so concurrent saves don't pick the same generation
+        self.snapshot_lock: threading.Lock = threading.Lock()
         self.statistics: Dict[str, Dict] = {}
+        # Player whose matches are aggregated, and which of their matches are
+        self.puuid: Optional[str] = None
+        self.included_match_ids: Set[str] = set()
+        self.snapshot_generation: int = 0
 
     @staticmethod
     def _safe_divide(a: int, b: int, default: float = 0.0) -> float:
@@ -54,65 +69,192 @@ class AnalyticsService:
 
     def get_stats(self, map_id: str, target_queue: str, target_side: str, target_plant_time: str):
         with self.stats_mutex:
-            result = {}
-
-            for zone in self.map_service.get_map(map_id).get_zones():
-                result[zone] = {
-                    'k': 0, 'd': 0, 'presence': 0, 'events': []
-                }
+            game_map: GameMap = self.map_service.get_map(map_id)
+            sides: List[int] = [Sides.index(side) for side in self._get_sides(target_side)]
+            plant_times: List[int] = [PlantTimes.index(plant_time)
+                                      for plant_time in self._get_plant_times(target_plant_time)]
 
-            total_events: int = 0
+            # Kills and deaths by zone ordinal
+            counts: np.ndarray = np.zeros((len(game_map.zones), len(Roles)), dtype=np.int64)
+            events: List[np.ndarray] = []
             for queue in self._get_queues(target_queue):
-                for side in self._get_sides(target_side):
-                    for plant_time in self._get_plant_times(target_plant_time):
-                        total_events += self.statistics[map_id][queue][side][plant_time]['total_events']
-                        for zone_name, zone_stats in self.statistics[map_id][queue][side][plant_time]['zones'].items():
-                            result[zone_name]['k'] += zone_stats['k']
-                            result[zone_name]['d'] += zone_stats['d']
-                            result[zone_name]['presence'] += zone_stats['presence']
-                            result[zone_name]['events'].extend(zone_stats['events'])
-
-            for zone in result.keys():
+                queue_stats: Dict = self.statistics[map_id][queue]
+                counts += queue_stats['counts'][np.ix_(sides, plant_times)].sum(axis=(0, 1))
+                queue_events: np.ndarray = queue_stats['events']
+                events.append(queue_events[np.isin(queue_events['side'], sides)
+                                           & np.isin(queue_events['plant_time'], plant_times)])
+            selected_events: np.ndarray = np.concatenate(events)
+            total_events: int = int(counts.sum())
+
+            result = {}
+            for ordinal, zone in enumerate(game_map.get_zones()):
+                kills, deaths = (int(count) for count in counts[ordinal])
+                zone_events: np.ndarray = selected_events[selected_events['zone'] == ordinal]
                 result[zone] = {
-                    'kd': self._safe_divide(result[zone]['k'], result[zone]['d'], default=result[zone]['k']),
-                    'presence': self._safe_divide(result[zone]['presence'], total_events, default=0.0),
-                    'events': result[zone]['events']
+                    'kd': self._safe_divide(kills, deaths, default=kills),
+                    'presence': self._safe_divide(kills + deaths, total_events, default=0.0),
+                    'events': [{'r': Roles[role], 'k': killer, 'v': victim} for role, killer, victim
+                               in zip(zone_events['role'].tolist(), zone_events['killer'].tolist(),
+                                      zone_events['victim'].tolist())]
                 }
 
             return result
 
-    def aggregate_statistics(self, matches: List[Match]):
+    def _reset_statistics(self):
+        self.statistics = {}
+        for map_id, game_map in self.map_service.get_maps().items():
+            self.statistics[map_id] = {}
+            for queue in ApiService.QueueTypes:
+                self.statistics[map_id][queue] = {
+                    'matches': 0,
+                    'counts': np.zeros((len(Sides), len(PlantTimes), len(game_map.zones), len(Roles)),
+                                       dtype=np.int64),
+                    'events': np.empty(0, dtype=MatchStats.EventDtype)
+                }
+        self.included_match_ids = set()
+
+    def aggregate_statistics(self, matches: List[Match], puuid: Optional[str] = None):
+        """
+        Aggregate the stats of the matches of a player. Matches already aggregated for the same player, e.g. from
+        a snapshot, are not added again.
+        """
         with self.stats_mutex:
+            match_ids: Set[str] = {match.match_id for match in matches}
+            if puuid is None or puuid != self.puuid or not self.included_match_ids.issubset(match_ids):
+                self._reset_statistics()
+            self.puuid = puuid
+
+            new_matches: List[Match] = [match for match in matches
+                                        if match.match_id not in self.included_match_ids and match.stats is not None]
+            logger.debug(f'Aggregating {len(new_matches)} new of {len(matches)} matches...')
+            events: Dict[Tuple[str, str], List[np.ndarray]] = {}
+            for match in new_matches:
+                queue_stats: Dict = self.statistics[match.map_id][match.queue]
+                queue_stats['matches'] += 1
+                queue_stats['counts'] += match.stats.counts
+                events.setdefault((match.map_id, match.queue), [queue_stats['events']]).append(match.stats.events)
+                self.included_match_ids.add(match.match_id)
+            for (map_id, queue), event_arrays in events.items():
+                self.statistics[map_id][queue]['events'] = np.concatenate(event_arrays)
+
+    @staticmethod
+    def _get_snapshot_directory(puuid: str) -> str:
+        return FileManager.get_storage_path(os.path.join('snapshots', puuid))
+
+    @staticmethod
+    def _get_saved_generation(directory: str) -> int:
+        try:
+            with open(os.path.join(directory, 'manifest.json'), 'r') as f:
+                return json.loads(f.read()).get('generation', 0)
+        except (OSError, ValueError):
+            return 0
+
+    def load_snapshot(self, puuid: str) -> bool:
+        """
+        Load the aggregated stats of a player saved by save_snapshot. The events are memory mapped, so this takes
+        milliseconds regardless of the number of matches.
+        :return: whether the snapshot exists and is still valid for the current stats version and map zones
+        """
+        directory: str = self._get_snapshot_directory(puuid)
+        try:
+            with open(os.path.join(directory, 'manifest.json'), 'r') as f:
+                manifest: Dict = json.loads(f.read())
+            if manifest['version'] != AnalyticsService.SnapshotVersion \
+                    or manifest['stats_version'] != MatchService.StatsVersion:
+                logger.debug('Statistics snapshot is outdated.')
+                return False
+            generation: int = manifest['generation']
+
+            statistics: Dict[str, Dict] = {}
             for map_id, game_map in self.map_service.get_maps().items():
-                self.statistics[map_id] = {}
+                map_manifest: Optional[Dict] = manifest['maps'].get(map_id)
+                if map_manifest is None or map_manifest['zone_hash'] != game_map.zone_hash:
+                    logger.debug(f'Statistics snapshot is outdated for map {map_id}.')
+                    return False
+                prefix: str = os.path.join(directory, f'{generation}.{map_manifest["file"]}')
+                counts: np.ndarray = np.load(f'{prefix}.counts.npy')
+                statistics[map_id] = {}
+                for index, queue in enumerate(ApiService.QueueTypes):
+                    statistics[map_id][queue] = {
+                        'matches': map_manifest['matches'][queue],
+                        'counts': counts[index],
+                        'events': np.load(f'{prefix}.{queue}.events.npy', mmap_mode='r')
+                    }
+            match_ids: np.ndarray = np.load(os.path.join(directory, f'{generation}.match_ids.npy'))
+        except FileNotFoundError:
+            return False
+        except (ValueError, KeyError, OSError) as e:
+            logger.error(f'Could not load statistics snapshot: {str(e)}')
+            logger.error(traceback.format_exc())
+            return False
+
+        with self.stats_mutex:
+            self.statistics = statistics
+            self.puuid = puuid
+            self.included_match_ids = {match_id.decode('ascii') for match_id in match_ids.tolist()}
+            self.snapshot_generation = generation
+        logger.debug(f'Loaded statistics snapshot of {len(self.included_match_ids)} matches.')
+        return True
+
+    def save_snapshot(self):
+        """
+        Save the aggregated stats of the current player. Every save writes a new generation of files and then
+        switches the manifest over to it, so a snapshot that is memory mapped or being written is never overwritten.
+        The stats are only locked while they are copied, not while the files are written, so drawing them doesn't
+        wait for the save.
+        """
+        with self.snapshot_lock:
+            with self.stats_mutex:
+                if self.puuid is None:
+                    return
+                puuid: str = self.puuid
+                # Counts are added to in place, while events are only ever replaced, so only the counts are copied
+                statistics: Dict[str, Dict] = {
+                    map_id: {
+                        'counts': np.stack([queue_statistics[queue]['counts'] for queue in ApiService.QueueTypes]),
+                        'events': {queue: queue_statistics[queue]['events'] for queue in ApiService.QueueTypes},
+                        'matches': {queue: queue_statistics[queue]['matches'] for queue in ApiService.QueueTypes}
+                    } for map_id, queue_statistics in self.statistics.items()
+                }
+                match_ids: np.ndarray = np.array(sorted(self.included_match_ids), dtype='S36')
+                snapshot_generation: int = self.snapshot_generation
+
+            directory: str = self._get_snapshot_directory(puuid)
+            os.makedirs(directory, exist_ok=True)
+            # Never write over the generation the manifest points to, even if it could not be loaded
+            generation: int = max(snapshot_generation, self._get_saved_generation(directory)) + 1
+            manifest: Dict = {
+                'version': AnalyticsService.SnapshotVersion,
+                'stats_version': MatchService.StatsVersion,
+                'generation': generation,
+                'maps': {}
+            }
+            for index, (map_id, game_map) in enumerate(self.map_service.get_maps().items()):
+                map_statistics: Dict = statistics[map_id]
+                # Map IDs contain slashes, and some maps share a UUID
+                file_name: str = f'map{index}'
+                prefix: str = os.path.join(directory, f'{generation}.{file_name}')
+                np.save(f'{prefix}.counts.npy', map_statistics['counts'])
                 for queue in ApiService.QueueTypes:
-                    self.statistics[map_id][queue] = {'matches': 0}
-                    for side in Sides:
-                        self.statistics[map_id][queue][side] = {}
-                        for plant_time in PlantTimes:
-                            self.statistics[map_id][queue][side][plant_time] = {
-                                'total_events': 0,
-                                'zones': {}
-                            }
-                            for zone_name in game_map.get_zones():
-                                self.statistics[map_id][queue][side][plant_time]['zones'][zone_name] = {
-                                    'k': 0,
-                                    'd': 0,
-                                    'presence': 0.0,
-                                    'events': []
-                                }
-            for match in matches:
-                self.statistics[match.map_id][match.queue]['matches'] += 1
-                for side in Sides:
-                    for plant_time in PlantTimes:
-                        for zone in self.map_service.get_map(match.map_id).get_zones():
-                            zone_stats = match.stats[side][plant_time]['zones'][zone]
-                            ref = self.statistics[match.map_id][match.queue][side][plant_time]['zones'][zone]
-                            ref['k'] += zone_stats['k']
-                            ref['d'] += zone_stats['d']
-
-                            events: int = zone_stats['k'] + zone_stats['d']
-                            ref['presence'] += events
-                            ref['events'].extend(zone_stats['events'])
-
-                            self.statistics[match.map_id][match.queue][side][plant_time]['total_events'] += events
+                    np.save(f'{prefix}.{queue}.events.npy', map_statistics['events'][queue])
+                manifest['maps'][map_id] = {
+                    'file': file_name,
+                    'zone_hash': game_map.zone_hash,
+                    'matches': map_statistics['matches']
+                }
+            np.save(os.path.join(directory, f'{generation}.match_ids.npy'), match_ids)
+
+            manifest_path: str = os.path.join(directory, 'manifest.json')
+            with open(manifest_path + '.tmp', 'w') as f:
+                f.write(json.dumps(manifest))
+            os.replace(manifest_path + '.tmp', manifest_path)
+            with self.stats_mutex:
+                self.snapshot_generation = generation
+
+            # Files of older generations that are still memory mapped are removed by a later save
+            for file_name in os.listdir(directory):
+                if file_name != 'manifest.json' and not file_name.startswith(f'{generation}.'):
+                    try:
+                        os.remove(os.path.join(directory, file_name))
+                    except OSError:
+                        pass
@@ -1,15 +1,15 @@
 from src.api.api import ValorantAPI
 from src.utils import logger
 
-from typing import Optional, Tuple, Dict
+from typing import Optional, Tuple, Dict, List, Iterable, Callable
 
 
 class ApiService:
 
     QueueTypes = ('competitive', 'unrated', 'custom')
 
-    def __init__(self, region):
-        self.api = ValorantAPI(region=region)
+    def __init__(self, region, pool_size: int = ValorantAPI.DefaultPoolSize):
+        self.api = ValorantAPI(region=region, pool_size=pool_size)
         self.puuid: Optional[str] = None
         self.is_authed: bool = False
 
@@ -22,12 +22,16 @@ class ApiService:
         logger.debug(f'Current region: {self.api.region} | Shard: {self.api.shard}')
 
     def try_auth(self) -> bool:
-        self.puuid, _ = self.api.get_auth(force=True, cache_headers=True)
+        # Reuses the stored tokens until they are about to expire
+        self.puuid, _ = self.api.get_auth(force=False, cache_headers=True)
         if self.puuid is not None:
             self.is_authed = True
             return True
         return False
 
+    def on_close(self):
+        self.api.close()
+
     # def get_maps_info(self):
     #     self.maps = {}
     #     maps_info = self.api.get_maps()
@@ -50,6 +54,28 @@ class ApiService:
     def get_all_match_history(self, puuid: str, queue: str):
         return self.api.get_all_match_history(puuid, queue=queue)
 
+    @needs_auth
+    def get_all_match_histories(self, puuid: str, queues: Iterable[str],
+                                is_known: Optional[Callable[[str, Dict], bool]] = None) -> Dict:
+        """
+        Fetch the match history of several queues concurrently.
+        :param is_known: if given, only list each queue until a page of already synced matches is reached.
+                         Called with the queue and the match history entry.
+        :return: the merged history, de-duplicated by match ID, the sum of the queue totals,
+                 and the listed history of each queue
+        """
+        def request(queue: str) -> Dict:
+            if is_known is None:
+                return self.api.get_all_match_history(puuid, queue=queue)
+            return self.api.get_new_match_history(puuid, lambda entry: is_known(queue, entry), queue=queue)
+
+        queues = tuple(queues)
+        results: List[Dict] = self.api.map_concurrently(request, queues)
+        history: List[Dict] = ValorantAPI.dedupe_match_history(
+            entry for result in results for entry in result['History'])
+        return {'History': history, 'Total': sum(result.get('Total', 0) for result in results),
+                'Queues': {queue: result['History'] for queue, result in zip(queues, results)}}
+
     @needs_auth
     def get_match_info(self, match_id: str) -> Dict:
         return self.api.get_match_info(match_id)
@@ -2,53 +2,194 @@ import traceback
 import os
 import sys
 import json
+import zlib
+import time
 import threading
+import multiprocessing
 from pprint import pprint
 from datetime import datetime, timezone
-from typing import List, Optional, Dict, Tuple, Callable
-from peewee import Model, Metadata, SqliteDatabase, FixedCharField, CharField, DateTimeField, IntegerField
-from playhouse.shortcuts import model_to_dict
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import List, Optional, Dict, Tuple, Callable, Iterator, Union, NamedTuple, Set
+from peewee import Model, Metadata, FixedCharField, CharField, DateTimeField, IntegerField, \
+    BlobField, ForeignKeyField, Field, fn
 from playhouse.migrate import SqliteMigrator, migrate
+from playhouse.pool import PooledSqliteDatabase
 
-from src.api.api import ValorantConstants
+from src.api.api import ValorantConstants, ApiRequestError
 from src.utils import FileManager, logger
 from src.services.api_service import ApiService
 from src.services.map_service import MapService
-from src.models.models import Match, GameMap
+from src.services.pipeline import Pipeline, Stage, ProgressTracker
+from src.models.models import Match, MatchStats, GameMap, Sides, PlantTimes, Roles
 
 
-db = SqliteDatabase(None, pragmas=(('cache_size', -1024 * 64), ('journal_mode', 'wal')))
+# One pooled connection per thread that uses the database. With WAL, readers never wait for the writer, and
+# concurrent writers wait for each other for up to busy_timeout milliseconds. Connections are handed between threads
+# by the pool, so every thread must close its connection (e.g. with db.connection_context()) once it is done.
+db = PooledSqliteDatabase(None, max_connections=16, stale_timeout=300, check_same_thread=False,
+                          pragmas=(('cache_size', -1024 * 64), ('journal_mode', 'wal'), ('busy_timeout', 30000)))
+# Held for the whole of a sync. Maintenance that keeps the write lock for long, like VACUUM, takes it too, so it
+# never makes the writes of a sync wait past busy_timeout.
+sync_lock = threading.Lock()
+
+
+def add_matchmodel_column(name: str, field: Field):
+    if name in {column.name for column in db.get_columns('matchmodel')}:
+        return
+    logger.debug(f'Column "{name}" does not exist! Migrating...')
+    migrate(SqliteMigrator(db).add_column('matchmodel', name, field))
+
+
+def add_match_indexes():
+    # Stored matches are listed per player newest first, optionally by queue, and analytics group them by map
+    db.execute_sql('CREATE INDEX IF NOT EXISTS matchmodel_puuid_match_date '
+                   'ON matchmodel (puuid, match_date DESC, match_id)')
+    db.execute_sql('CREATE INDEX IF NOT EXISTS matchmodel_puuid_queue_match_date '
+                   'ON matchmodel (puuid, queue, match_date, match_id)')
+    db.execute_sql('CREATE INDEX IF NOT EXISTS matchmodel_puuid_map_id ON matchmodel (puuid, map_id)')
+
+
+def compress_raw_json_rows(batch_size: int = 50):
+    """
+    Compress the raw_json of rows stored before it was compressed. Runs in small transactions, so it can go on in
+    the background while matches are read and synced, and vacuums the database afterwards to return the space,
+    once no sync is running.
+    """
+    compressed: int = 0
+    while True:
+        with db.atomic():
+            rows = list(MatchModel.select(MatchModel.id, MatchModel.raw_json)
+                        .where(fn.typeof(MatchModel.raw_json) == 'text')
+                        .limit(batch_size))
+            for row in rows:
+                MatchModel.update(raw_json=row.raw_json).where(MatchModel.id == row.id).execute()
+        compressed += len(rows)
+        if len(rows) < batch_size:
+            break
+    if compressed > 0:
+        logger.debug(f'Compressed raw_json of {compressed} matches, vacuuming...')
+        with sync_lock:
+            db.execute_sql('VACUUM')
+
+
+def import_ignored_matches():
+    """
+    Import the matches ignored in storage.json, where they were kept before they were stored in the database.
+    """
+    try:
+        with open(FileManager.get_storage_path('storage.json'), 'r') as f:
+            match_ids: Dict = json.loads(f.read())
+    except FileNotFoundError:
+        return
+    except ValueError as e:
+        logger.error(f'Could not load storage.json: {str(e)}')
+        logger.error(traceback.format_exc())
+        return
+    ignored_at: datetime = datetime.now(tz=timezone.utc)
+    rows: List[Dict] = [dict(match_id=match_id, game_mode=None, ignored_at=ignored_at) for match_id in match_ids]
+    for start in range(0, len(rows), 100):
+        IgnoredMatchModel.insert_many(rows[start:start + 100]).on_conflict_ignore().execute()
+    logger.debug(f'Imported {len(rows)} ignored matches from storage.json')
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[], None]
+    # Runs in the background while the app is in use, after the other pending migrations. Online migrations may
+    # only rewrite data, since the migrations after them don't wait for them.
+    online: bool = False
+
+
+# Ordered by version. Every migration must be idempotent, since one that was interrupted is applied again.
+Migrations: List[Migration] = [
+    Migration(1, 'Add queue column', lambda: add_matchmodel_column('queue', CharField(default='competitive'))),
+    Migration(2, 'Add map_id column', lambda: add_matchmodel_column('map_id', CharField(default=''))),
+    Migration(3, 'Add stats column', lambda: add_matchmodel_column('stats', CharField(default=None, null=True))),
+    Migration(4, 'Add match indexes', add_match_indexes),
+    Migration(5, 'Compress raw_json', compress_raw_json_rows, online=True),
+    Migration(6, 'Import ignored matches from storage.json', import_ignored_matches)
+]
+
+
+def apply_migration(migration: Migration):
+    logger.debug(f'Applying migration {migration.version}: {migration.description}...')
+    if migration.online:
+        # Online migrations manage their own transactions
+        migration.apply()
+        SchemaVersionModel.create(version=migration.version, applied_at=datetime.now(tz=timezone.utc))
+        return
+    with db.atomic():
+        migration.apply()
+        SchemaVersionModel.create(version=migration.version, applied_at=datetime.now(tz=timezone.utc))
+
+
+def apply_online_migrations(migrations: List[Migration]):
+    try:
+        for migration in migrations:
+            apply_migration(migration)
+    except Exception as e:
+        logger.error(f'Could not apply migration: {str(e)}')
+        logger.error(traceback.format_exc())
+    finally:
+        db.close()
 
 
 def execute_migrations():
-    migrator = SqliteMigrator(db)
+    """
+    Apply the migrations that have not been applied to the database yet, in order. Online migrations continue on
+    a background thread once the others are applied.
+    """
+    db.create_tables([SchemaVersionModel])
+    applied: Set[int] = {version for version, in SchemaVersionModel.select(SchemaVersionModel.version).tuples()}
+    pending: List[Migration] = [migration for migration in Migrations if migration.version not in applied]
+    if not pending:
+        logger.debug(f'Database schema is up to date (version {max(applied)}).')
+        return
+
+    logger.debug(f'Performing {len(pending)} migrations...')
+    for migration in pending:
+        if not migration.online:
+            apply_migration(migration)
+    online: List[Migration] = [migration for migration in pending if migration.online]
+    if online:
+        threading.Thread(target=apply_online_migrations, args=(online,), name='online-migrations',
+                         daemon=True).start()
 
-    columns = {}
-    for column in db.get_columns('matchmodel'):
-        columns[column.name] = True
 
-    migrations = []
+class CompressedJSONField(BlobField):
+    """
+    JSON text stored zlib-compressed. Most of a match details payload is the same keys over and over, so the
+    compressor is primed with a preset dictionary of them. The first byte of a value names the dictionary it was
+    compressed with. Rows stored before compression are plain text and are read back unchanged.
+    """
+    DictionaryDirectory: Path = Path('resources/compression')
+    Dictionaries: Dict[int, str] = {1: 'match_details_v1.dict'}
+    CurrentVersion: int = 1
+    CompressionLevel: int = 6
 
-    if 'queue' not in columns:
-        logger.debug('Column "queue" does not exist! Migrating...')
-        queue_field = CharField(default='competitive')
-        migrations.append(migrator.add_column('matchmodel', 'queue', queue_field))
+    _loaded_dictionaries: Dict[int, bytes] = {}
 
-    if 'map_id' not in columns:
-        logger.debug('Column "map_id" does not exist! Migrating...')
-        map_id_field = CharField(default='')
-        migrations.append(migrator.add_column('matchmodel', 'map_id', map_id_field))
+    @classmethod
+    def get_dictionary(cls, version: int) -> bytes:
+        if version not in cls._loaded_dictionaries:
+            cls._loaded_dictionaries[version] = (cls.DictionaryDirectory / cls.Dictionaries[version]).read_bytes()
+        return cls._loaded_dictionaries[version]
 
-    if 'stats' not in columns:
-        logger.debug('Column "stats" does not exist! Migrating...')
-        stats_field = CharField(default=None, null=True)
-        migrations.append(migrator.add_column('matchmodel', 'stats', stats_field))
+    def db_value(self, value: Optional[Union[str, bytes]]) -> Optional[bytes]:
+        if value is None or isinstance(value, bytes):
+            return value
+        compressor = zlib.compressobj(self.CompressionLevel, zdict=self.get_dictionary(self.CurrentVersion))
+        data: bytes = compressor.compress(value.encode('utf-8')) + compressor.flush()
+        return super().db_value(bytes([self.CurrentVersion]) + data)
 
-    if migrations:
-        logger.debug(f'Performing {len(migrations)} migrations...')
-        migrate(*migrations)
-    else:
-        logger.debug(f'No migrations needed.')
+    def python_value(self, value: Optional[Union[str, bytes]]) -> Optional[str]:
+        if value is None or isinstance(value, str):
+            return value
+        value = bytes(value)
+        decompressor = zlib.decompressobj(zdict=self.get_dictionary(value[0]))
+        return (decompressor.decompress(value[1:]) + decompressor.flush()).decode('utf-8')
 
 
 class ThreadSafeDatabaseMetadata(Metadata):
@@ -82,38 +223,313 @@ class MatchModel(BaseModel):
     my_deaths = IntegerField()
     my_assists = IntegerField()
     my_score = IntegerField()
-    raw_json = CharField()
+    raw_json = CompressedJSONField()
     queue = CharField()
-    stats = CharField(default=None, null=True)
+    stats = BlobField(default=None, null=True)
     map_id = CharField()
 
     class Meta:
         database = db
 
 
+class IgnoredMatchModel(BaseModel):
+    """
+    A match that is not stored because its game mode is not supported, so it is never downloaded again.
+    """
+    match_id = FixedCharField(max_length=36, unique=True)
+    # None for matches ignored before the game mode was recorded
+    game_mode = CharField(null=True)
+    ignored_at = DateTimeField()
+
+    class Meta:
+        database = db
+
+
+class PendingMatchModel(BaseModel):
+    """
+    A listed match whose details could not be fetched. Incremental syncs stop listing at the matches stored after
+    it, so it is fetched again at the start of every sync until it is stored or ignored.
+    """
+    match_id = FixedCharField(max_length=36, unique=True)
+    puuid = FixedCharField(max_length=36)
+    failed_at = DateTimeField()
+
+    class Meta:
+        database = db
+        table_name = 'pending_match'
+
+
+class SchemaVersionModel(BaseModel):
+    # One row per applied migration
+    version = IntegerField(primary_key=True)
+    applied_at = DateTimeField()
+
+    class Meta:
+        database = db
+        table_name = 'schema_version'
+
+
+class SyncStateModel(BaseModel):
+    puuid = FixedCharField(max_length=36)
+    queue = CharField()
+    # Start time (POSIX millis) of the newest match that was synced along with everything older than it
+    newest_game_start = IntegerField()
+    newest_match_id = FixedCharField(max_length=36)
+    synced_at = DateTimeField()
+
+    class Meta:
+        database = db
+        indexes = (
+            (('puuid', 'queue'), True),
+        )
+
+
+class KillEventModel(BaseModel):
+    """
+    One kill of a stored match, with the positions of the killer and victim already resolved to map zones, so
+    statistics can be computed from indexed rows instead of the match details JSON.
+    """
+    match = ForeignKeyField(MatchModel, field=MatchModel.match_id, backref='kill_events', on_delete='CASCADE')
+    map_id = CharField()
+    round = IntegerField()
+    round_time = IntegerField()
+    # 'preplant' or 'postplant'
+    plant_phase = CharField()
+    killer_puuid = FixedCharField(max_length=36, null=True)
+    killer_x = IntegerField(null=True)
+    killer_y = IntegerField(null=True)
+    # 'attacker' or 'defender', None if the team is unknown
+    killer_side = CharField(null=True)
+    killer_zone = CharField(null=True)
+    victim_puuid = FixedCharField(max_length=36)
+    victim_x = IntegerField()
+    victim_y = IntegerField()
+    victim_side = CharField(null=True)
+    victim_zone = CharField(null=True)
+
+    class Meta:
+        database = db
+        table_name = 'kill_event'
+        indexes = (
+            (('killer_puuid', 'map_id'), False),
+            (('victim_puuid', 'map_id'), False),
+        )
+
+
+class MatchPlayerModel(BaseModel):
+    """
+    One player of a stored match, stored along with its kill events, so every player can be analyzed again without
+    the match details JSON, even those who neither killed nor died.
+    """
+    match = ForeignKeyField(MatchModel, field=MatchModel.match_id, backref='players', on_delete='CASCADE')
+    puuid = FixedCharField(max_length=36)
+    team = CharField()
+
+    class Meta:
+        database = db
+        table_name = 'match_player'
+        indexes = (
+            (('match', 'puuid'), True),
+            (('puuid',), False),
+        )
+
+
+class PlayerStatsModel(BaseModel):
+    """
+    Stats of every player of a stored match, not only of the player who synced it, written when all players are
+    analyzed.
+    """
+    match = ForeignKeyField(MatchModel, field=MatchModel.match_id, backref='player_stats', on_delete='CASCADE')
+    puuid = FixedCharField(max_length=36)
+    map_id = CharField()
+    # Encoded MatchStats
+    stats = BlobField()
+
+    class Meta:
+        database = db
+        table_name = 'player_stats'
+        indexes = (
+            (('match', 'puuid'), True),
+            (('puuid', 'map_id'), False),
+        )
+
+
+class BatchWriter:
+    """
+    Accumulates new matches and updates of stored matches, along with their kill events and players, and writes
+    them in a single transaction once enough matches are pending or the oldest pending one has waited long enough.
+    Every flush is atomic, so a crash loses at most the pending matches, which are synced or re-analyzed again next
+    time.
+    """
+
+    def __init__(self, max_matches: int = 16, max_delay: float = 0.5):
+        """
+        :param max_matches: flush once this many matches are pending
+        :param max_delay: flush once the oldest pending match has waited this many seconds
+        """
+        self.max_matches: int = max_matches
+        self.max_delay: float = max_delay
+        self.inserts: List[Dict] = []
+        self.ignored: List[Dict] = []
+        self.updates: Dict[str, Dict] = {}
+        self.kill_events: Dict[str, List[Dict]] = {}
+        self.rosters: Dict[str, List[Dict]] = {}
+        self.player_stats: Dict[str, List[Dict]] = {}
+        self.pending_matches: List[Dict] = []
+        self.pending_since: Optional[float] = None
+
+    def __enter__(self) -> 'BatchWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+    def get_pending_count(self) -> int:
+        return len(self.inserts) + len(self.ignored) + len(self.updates) + len(self.pending_matches)
+
+    def add_match(self, fields: Dict, kill_events: List[Dict], roster: List[Dict],
+                  player_stats: Optional[List[Dict]] = None):
+        """
+        Queue a new match for insertion. A match that is already stored is left untouched.
+        """
+        self.inserts.append(fields)
+        self.kill_events[fields['match_id']] = kill_events
+        self.rosters[fields['match_id']] = roster
+        if player_stats is not None:
+            self.player_stats[fields['match_id']] = player_stats
+        self._on_added()
+
+    def ignore_match(self, match_id: str, game_mode: str):
+        """
+        Queue a match to be ignored by later syncs.
+        """
+        self.ignored.append(dict(match_id=match_id, game_mode=game_mode, ignored_at=datetime.now(tz=timezone.utc)))
+        self._on_added()
+
+    def add_pending_match(self, match_id: str, puuid: str):
+        """
+        Queue a match whose details could not be fetched, to be fetched again by the next sync.
+        """
+        self.pending_matches.append(dict(match_id=match_id, puuid=puuid, failed_at=datetime.now(tz=timezone.utc)))
+        self._on_added()
+
+    def update_match(self, match_id: str, updates: Dict, kill_events: Optional[List[Dict]] = None,
+                     roster: Optional[List[Dict]] = None, player_stats: Optional[List[Dict]] = None):
+        """
+        Queue an update of the columns of a stored match, replacing its kill events, players and player stats if
+        they are given.
+        """
+        self.updates.setdefault(match_id, {}).update(updates)
+        if kill_events is not None:
+            self.kill_events[match_id] = [{key: value for key, value in event.items() if key != 'id'}
+                                          for event in kill_events]
+        if roster is not None:
+            self.rosters[match_id] = roster
+        if player_stats is not None:
+            self.player_stats[match_id] = player_stats
+        self._on_added()
+
+    def _on_added(self):
+        if self.pending_since is None:
+            self.pending_since = time.monotonic()
+        if self.get_pending_count() >= self.max_matches \
+                or time.monotonic() - self.pending_since >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        if self.get_pending_count() == 0:
+            return
+        kill_events: List[Dict] = [event for events in self.kill_events.values() for event in events]
+        roster: List[Dict] = [row for rows in self.rosters.values() for row in rows]
+        player_stats: List[Dict] = [row for rows in self.player_stats.values() for row in rows]
+        with db.atomic():
+            if self.inserts:
+                MatchModel.insert_many(self.inserts).on_conflict_ignore().execute()
+            if self.ignored:
+                IgnoredMatchModel.insert_many(self.ignored).on_conflict_ignore().execute()
+            if self.pending_matches:
+                PendingMatchModel.insert_many(self.pending_matches).on_conflict_ignore().execute()
+            if self.inserts or self.ignored:
+                # Fetched at last, so they are not retried anymore
+                PendingMatchModel.delete().where(PendingMatchModel.match_id.in_(
+                    [row['match_id'] for row in self.inserts + self.ignored])).execute()
+            for match_id, updates in self.updates.items():
+                MatchModel.update(**updates).where(MatchModel.match_id == match_id).execute()
+            if self.kill_events:
+                # A match stored concurrently keeps a single copy of its kill events
+                KillEventModel.delete().where(KillEventModel.match.in_(list(self.kill_events))).execute()
+            for start in range(0, len(kill_events), MatchService.KillEventInsertBatchSize):
+                KillEventModel.insert_many(kill_events[start:start + MatchService.KillEventInsertBatchSize]) \
+                    .execute()
+            if self.rosters:
+                MatchPlayerModel.delete().where(MatchPlayerModel.match.in_(list(self.rosters))).execute()
+            for start in range(0, len(roster), MatchService.MatchPlayerInsertBatchSize):
+                MatchPlayerModel.insert_many(roster[start:start + MatchService.MatchPlayerInsertBatchSize]).execute()
+            if self.player_stats:
+                PlayerStatsModel.delete().where(PlayerStatsModel.match.in_(list(self.player_stats))).execute()
+            for start in range(0, len(player_stats), MatchService.PlayerStatsInsertBatchSize):
+                PlayerStatsModel.insert_many(player_stats[start:start + MatchService.PlayerStatsInsertBatchSize]) \
+                    .execute()
+        self.inserts = []
+        self.ignored = []
+        self.updates = {}
+        self.kill_events = {}
+        self.rosters = {}
+        self.player_stats = {}
+        self.pending_matches = []
+        self.pending_since = None
+
+
+class IgnoredMatch(NamedTuple):
+    match_id: str
+    match_info: Dict
+
+
+class FailedMatch(NamedTuple):
+    match_id: str
+
+
 class MatchService:
 
-    StatsVersion: int = 1
+    StatsVersion: int = 3
+    PersistBatchSize: int = 16
+    # Kills in gaps between zones are attributed to the nearest zone within this distance, in normalized map space
+    # (the minimap is 1 wide). Stats have to be recomputed when it changes, so bump StatsVersion along with it
+    ZoneGapDistance: float = 0.01
+    # Stays below SQLite's limit of 999 variables per statement
+    KillEventInsertBatchSize: int = 50
+    MatchPlayerInsertBatchSize: int = 200
+    PlayerStatsInsertBatchSize: int = 200
+    # Fewer outdated matches than this are updated on the calling thread, since starting processes takes a while
+    ReanalysisPoolThreshold: int = 64
 
-    def __init__(self, api_service: ApiService, map_service: MapService):
+    def __init__(self, api_service: ApiService, map_service: MapService, fetch_concurrency: Optional[int] = None,
+                 reanalysis_workers: Optional[int] = None, analyze_all_players: bool = False):
+        """
+        :param analyze_all_players: also compute and store the stats of every other player of each match
+        """
         self.api_service: ApiService = api_service
         self.map_service: MapService = map_service
+        self.analyze_all_players: bool = analyze_all_players
+        # Default to one process per core
+        self.reanalysis_workers: int = (os.cpu_count() or 1) if reanalysis_workers is None \
+            else max(1, reanalysis_workers)
+        # Default to one fetcher per pooled connection
+        self.fetch_concurrency: int = api_service.api.pool_size if fetch_concurrency is None \
+            else max(1, fetch_concurrency)
 
         logger.debug(f'Current working directory: {os.getcwd()}')
         logger.debug(f'Executable directory: {sys.executable}')
         logger.debug(f'Storage directory: {FileManager.get_storage_path("")}')
         db.init(FileManager.get_storage_path('matches.db'))
         db.connect()
-        db.create_tables([MatchModel])
+        db.create_tables([MatchModel, SyncStateModel, KillEventModel, IgnoredMatchModel, PlayerStatsModel,
+                          PendingMatchModel, MatchPlayerModel])
         execute_migrations()
 
-        try:
-            with open(FileManager.get_storage_path('storage.json'), 'r') as f:
-                self.ignored_match_ids: Dict = json.loads(f.read())
-        except Exception as e:
-            logger.error(f'Could not load storage.json: {str(e)}')
-            logger.error(traceback.format_exc())
-            self.ignored_match_ids = {}
+        # Checked for every listed match, so keep them in memory
+        self.ignored_match_ids: Set[str] = {match_id for match_id, in IgnoredMatchModel.select(
+            IgnoredMatchModel.match_id).tuples()}
 
     def _opposing_team(self, my_team: str) -> str:
         if my_team == ValorantConstants.Team.Blue.value:
@@ -145,7 +561,36 @@ class MatchService:
             hashmap[match.match_id] = True
         return hashmap
 
-    def _store_match(self, match_info: Dict, puuid: str) -> Optional[MatchModel]:
+    @staticmethod
+    def _get_pending_match_ids(puuid: str) -> List[str]:
+        query = PendingMatchModel.select(PendingMatchModel.match_id) \
+            .where(PendingMatchModel.puuid == puuid) \
+            .order_by(PendingMatchModel.failed_at)
+        return [match_id for match_id, in query.tuples()]
+
+    def _get_sync_watermarks(self, puuid: str) -> Dict[str, int]:
+        query = SyncStateModel.select(SyncStateModel.queue, SyncStateModel.newest_game_start) \
+            .where(SyncStateModel.puuid == puuid)
+        return {state.queue: state.newest_game_start for state in query}
+
+    def _update_sync_watermarks(self, puuid: str, queue_histories: Dict[str, List[Dict]],
+                                watermarks: Dict[str, int]):
+        for queue, history in queue_histories.items():
+            if not history:
+                continue
+            newest_entry: Dict = max(history, key=lambda entry: entry['GameStartTime'])
+            if newest_entry['GameStartTime'] <= watermarks.get(queue, -1):
+                continue
+            SyncStateModel.replace(puuid=puuid, queue=queue, newest_game_start=newest_entry['GameStartTime'],
+                                   newest_match_id=newest_entry['MatchID'],
+                                   synced_at=datetime.now(tz=timezone.utc)).execute()
+            logger.debug(f'Sync watermark for {queue} moved to match {newest_entry["MatchID"]}')
+
+    def _build_match_fields(self, match_info: Dict, puuid: str) -> Optional[Dict]:
+        """
+        Extract the columns of a MatchModel row from the match details.
+        :return: the fields, with stats still unset, or None if the match details are malformed
+        """
         try:
             player_info = next(player for player in match_info['players'] if player['subject'] == puuid)
             my_team: str = player_info['teamId']
@@ -169,113 +614,344 @@ class MatchService:
 
             logger.debug(f'({my_match_score} - {opponent_match_score}), {my_kills}/{my_deaths}/{my_assists}')
 
-            model = MatchModel.create(match_id=match_info['matchInfo']['matchId'], puuid=puuid, my_team=my_team,
-                                      my_match_score=my_match_score, opponent_match_score=opponent_match_score,
-                                      match_date=match_date, my_kills=my_kills, my_deaths=my_deaths,
-                                      my_assists=my_assists, my_score=my_score, raw_json=json.dumps(match_info),
-                                      queue=queue, stats=None, map_id=map_id)
-            return model
-        except KeyError as e:
+            return dict(match_id=match_info['matchInfo']['matchId'], puuid=puuid, my_team=my_team,
+                        my_match_score=my_match_score, opponent_match_score=opponent_match_score,
+                        match_date=match_date, my_kills=my_kills, my_deaths=my_deaths,
+                        my_assists=my_assists, my_score=my_score, raw_json=json.dumps(match_info),
+                        queue=queue, stats=None, map_id=map_id)
+        except (KeyError, StopIteration) as e:
             logger.error(f'Malformed match info: {str(e)}')
             logger.error(traceback.format_exc())
             return None
 
-    def process_matches(self, puuid: str, progress_callback: Optional[Callable[[float], None]] = None):
+    @staticmethod
+    def _load_kill_events(match_id: str) -> List[Dict]:
+        return list(KillEventModel.select().where(KillEventModel.match == match_id).dicts())
+
+    @staticmethod
+    def _load_roster(match_id: str) -> List[Dict]:
+        return list(MatchPlayerModel.select(MatchPlayerModel.match, MatchPlayerModel.puuid, MatchPlayerModel.team)
+                    .where(MatchPlayerModel.match == match_id).dicts())
+
+    def _fetch_match_info(self, match_id: str) -> Optional[Dict]:
+        try:
+            return self.api_service.get_match_info(match_id)
+        except ApiRequestError as e:
+            logger.error(f'Could not fetch match {match_id}: {str(e)}')
+            return None
+
+    def _load_stored_matches(self, puuid: str) -> Iterator[Match]:
+        """
+        Stream the stored matches of a player, newest first, from a single query that leaves out the match details.
+        Matches whose map or stats are missing or outdated are filled in after the others, loading their match
+        details only if they are needed.
+        """
+        columns = [field for field in MatchModel._meta.sorted_fields if field is not MatchModel.raw_json]
+        if ValorantConstants.DebugMatchUUID:
+            condition = MatchModel.match_id == ValorantConstants.DebugMatchUUID
+        else:
+            condition = MatchModel.puuid == puuid
+        query = MatchModel.select(*columns).where(condition).order_by(MatchModel.match_date.desc())
+        # Matches whose players were all analyzed have a row for this player too, and so do their stored players.
+        # Matches stored before their players were only had those who killed or died analyzed
+        analyzed_rosters: Optional[Set[str]] = None
+        if self.analyze_all_players:
+            analyzed_rosters = {match_id for match_id, in PlayerStatsModel.select(PlayerStatsModel.match)
+                                .where(PlayerStatsModel.puuid == puuid).tuples()}
+            analyzed_rosters.intersection_update(match_id for match_id, in MatchPlayerModel.select(
+                MatchPlayerModel.match).where(MatchPlayerModel.puuid == puuid).tuples())
+
+        outdated_matches: List[Match] = []
+        for row in query.dicts().iterator():
+            match = Match(match_model=dict(row, raw_json=None))
+            if self._is_stored_match_outdated(match, analyzed_rosters):
+                outdated_matches.append(match)
+            else:
+                yield match
+        # The cursor is exhausted, so the updates don't interleave with it
+        yield from self._update_stored_matches(outdated_matches, puuid)
+
+    def _is_stored_match_outdated(self, match: Match, analyzed_rosters: Optional[Set[str]] = None) -> bool:
+        """
+        :param analyzed_rosters: IDs of the matches whose players were all analyzed, None if only this player is
+        """
+        if match.map_id is None or match.map_id == '' or ValorantConstants.DebugMatchUUID or match.stats is None:
+            return True
+        if analyzed_rosters is not None and match.match_id not in analyzed_rosters:
+            return True
+        # Stats schema or the zones of the map have been updated
+        game_map: Optional[GameMap] = self.map_service.get_map(match.map_id)
+        return game_map is not None and not match.stats.is_current(MatchService.StatsVersion, game_map)
+
+    @staticmethod
+    def _load_raw_json(match_id: str) -> str:
+        return MatchModel.select(MatchModel.raw_json).where(MatchModel.match_id == match_id).scalar()
+
+    @staticmethod
+    def _reanalyze_stored_match(match: Match, puuid: str, map_service: MapService, all_players: bool = False) \
+            -> Tuple[Dict, List[Dict], Optional[List[Dict]], Optional[List[Dict]]]:
+        """
+        Fill in the map and stats of a stored match. Only reads from the database, so it can run in any process.
+        :return: the updated columns, the kill events, the players if they were not stored yet and, if all players
+                 are analyzed, the player stats rows of the match
+        """
+        match_id: str = match.match_id
+        updates: Dict = {}
+        if match.map_id is None or match.map_id == '':
+            logger.debug(f'No map ID found for match {match_id}!')
+            match.match_info = MatchService._load_raw_json(match_id)
+            updates['map_id'] = match.map_id = match.get_map_id()
+            logger.debug(f"Set map_id to {match.map_id}")
+
+        logger.debug(f'Going to update stats for match {match_id} on map: {match.map_id}!')
+        game_map: GameMap = map_service.get_map(match.map_id)
+        kill_events: List[Dict] = MatchService._load_kill_events(match_id)
+        if kill_events:
+            # Zones may have changed along with the stats, so classify the stored positions again
+            MatchService._classify_kill_events(kill_events, game_map)
+        else:
+            # Stored before kill events were, so parse them out of the match details once
+            if match.match_info is None:
+                match.match_info = MatchService._load_raw_json(match_id)
+            kill_events = MatchService._build_kill_events(match, game_map)
+        roster: List[Dict] = MatchService._load_roster(match_id)
+        new_roster: Optional[List[Dict]] = None
+        if not roster and (all_players or match.match_info is not None):
+            # Stored before the players were, so take them from the match details once
+            if match.match_info is None:
+                match.match_info = MatchService._load_raw_json(match_id)
+            roster = new_roster = MatchService._build_roster(match)
+        match.stats, player_stats = MatchService._analyze_kill_events(match, kill_events, roster, game_map, puuid,
+                                                                      all_players)
+        updates['stats'] = match.stats.encode()
+        match.unload_match_info()
+        return updates, kill_events, new_roster, player_stats
+
+    def _update_stored_matches(self, matches: List[Match], puuid: str) -> Iterator[Match]:
+        """
+        Fill in the map and stats of stored matches, yielding each one once it is updated. Many matches, like all
+        of them after a StatsVersion bump, are spread over a process pool. Updates are written in batches, so an
+        interrupted update resumes from the last written batch, since only outdated matches are updated.
+        """
+        with BatchWriter(max_matches=MatchService.PersistBatchSize) as writer:
+            if len(matches) < MatchService.ReanalysisPoolThreshold or self.reanalysis_workers <= 1:
+                for match in matches:
+                    updates, kill_events, roster, player_stats = self._reanalyze_stored_match(
+                        match, puuid, self.map_service, self.analyze_all_players)
+                    writer.update_match(match.match_id, updates, kill_events, roster, player_stats)
+                    yield match
+                return
+
+            logger.debug(f'Updating {len(matches)} matches with {self.reanalysis_workers} processes...')
+            # Spawn, rather than fork, so the workers don't inherit open database connections
+            with ProcessPoolExecutor(max_workers=self.reanalysis_workers,
+                                     mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=init_reanalysis_worker,
+                                     initargs=(db.database,)) as executor:
+                futures: List[Future] = [executor.submit(reanalyze_in_worker,
+                                                         (match, puuid, self.analyze_all_players))
+                                         for match in matches]
+                try:
+                    for match, future in zip(matches, futures):
+                        updates, kill_events, roster, player_stats = future.result()
+                        match.map_id = updates.get('map_id', match.map_id)
+                        match.stats = MatchStats.decode(updates['stats'])
+                        writer.update_match(match.match_id, updates, kill_events, roster, player_stats)
+                        yield match
+                finally:
+                    # Stopped early, so don't wait for the rest
+                    for future in futures:
+                        future.cancel()
+
+    def _get_new_match_ids(self, online_match_history: List[Dict], stored_match_history: Dict) -> List[str]:
+        """
+        :return: the IDs of listed matches that are neither stored nor ignored, newest first
+        """
+        # Sort the match IDs by descending date before storing into the database
+        online_match_history = sorted(online_match_history, key=lambda m: m['GameStartTime'], reverse=True)
+        return [match_entry['MatchID'] for match_entry in online_match_history
+                if match_entry['MatchID'] not in stored_match_history
+                and match_entry['MatchID'] not in self.ignored_match_ids]
+
+    def _ignore_match(self, match_id: str, match_info: Dict, writer: BatchWriter):
+        self.ignored_match_ids.add(match_id)
+        writer.ignore_match(match_id, match_info['matchInfo']['gameMode'])
+
+    @staticmethod
+    def _is_supported_game_mode(match_info: Dict) -> bool:
+        # Only add 5v5s, no other custom gamemode
+        return match_info['matchInfo']['gameMode'] == '/Game/GameModes/Bomb/BombGameMode.BombGameMode_C'
+
+    def _is_known_match(self, queue: str, match_entry: Dict, stored_match_history: Dict,
+                        watermarks: Dict[str, int]) -> bool:
+        return match_entry['MatchID'] in stored_match_history \
+            or match_entry['MatchID'] in self.ignored_match_ids \
+            or match_entry['GameStartTime'] <= watermarks.get(queue, -1)
+
+    @db.connection_context()
+    def process_matches(self, puuid: str, progress_callback: Optional[Callable[[float], None]] = None,
+                        incremental: bool = True):
         """
         Fetch new matches, load old matches, and analyze the games.
+        New matches go through a pipeline (list history -> fetch details -> parse -> analyze -> persist) whose
+        stages run concurrently, while the stored matches are loaded on the calling thread.
         :param puuid: the player to fetch the matches for
         :param progress_callback: optional callback with progress values (0 to 1)
+        :param incremental: only list the match history up to the newest already synced match,
+                            instead of the entire history of every queue
         :return:
         """
+        with sync_lock:
+            return self._sync_matches(puuid, progress_callback, incremental)
+
+    def _sync_matches(self, puuid: str, progress_callback: Optional[Callable[[float], None]],
+                      incremental: bool) -> List[Match]:
         all_matches: List[Match] = []
+        # The listed history completes the total
+        progress: ProgressTracker = ProgressTracker(progress_callback, pending_totals=1)
+        pipeline: Optional[Pipeline] = None
         try:
             # Get a hashmap of all the stored match IDs
             stored_match_history: Dict = self._get_all_stored_match_ids(puuid)
+            progress.add_total(len(stored_match_history))
 
-            # Get a list of matches from VALORANT
-            online_match_history = []
-            expected_total: int = 0
-            if not ValorantConstants.DebugMatchUUID:
-                for queue in ApiService.QueueTypes:
-                    result: Dict = self.api_service.get_all_match_history(puuid, queue=queue)
-                    online_match_history.extend(result['History'])
-                    expected_total += result['Total']
+            watermarks: Dict[str, int] = self._get_sync_watermarks(puuid)
+            queue_histories: Dict[str, List[Dict]] = {}
+            failed_match_ids: List[str] = []
 
-                logger.debug(
-                    f'Found {len(online_match_history)} matches (expected {expected_total}) to process...')
+            def is_known(queue: str, match_entry: Dict) -> bool:
+                return self._is_known_match(queue, match_entry, stored_match_history, watermarks)
 
-            total_matches: int = len(stored_match_history) + len(online_match_history)
-            matches_processed: int = 0
+            def list_new_match_ids() -> Iterator[str]:
+                listed_count: int = 0
+                new_match_ids: List[str] = []
+                try:
+                    # Get a list of matches from VALORANT
+                    if ValorantConstants.DebugMatchUUID:
+                        return
+                    # Matches that could not be fetched by an earlier sync come first, since an incremental listing
+                    # stops at the newer matches stored after them
+                    new_match_ids = [match_id for match_id in self._get_pending_match_ids(puuid)
+                                     if match_id not in stored_match_history
+                                     and match_id not in self.ignored_match_ids]
+                    listed_count = len(new_match_ids)
+                    try:
+                        result: Dict = self.api_service.get_all_match_histories(puuid, ApiService.QueueTypes,
+                                                                                is_known if incremental else None)
+                    except ApiRequestError as e:
+                        # Still retry the pending matches and load the stored matches
+                        logger.error(f'Could not fetch match history: {str(e)}')
+                    else:
+                        queue_histories.update(result['Queues'])
+                        logger.debug(f'Found {len(result["History"])} matches (expected {result["Total"]}) '
+                                     f'to process...')
 
-            if total_matches == 0:
-                progress_callback(1.0)
-                return []
+                        # Matches that are already stored or ignored need no requests
+                        retried_match_ids: Set[str] = set(new_match_ids)
+                        listed_match_ids: List[str] = self._get_new_match_ids(result['History'],
+                                                                              stored_match_history)
+                        listed_count += len(result['History']) - len(retried_match_ids.intersection(listed_match_ids))
+                        new_match_ids += [match_id for match_id in listed_match_ids
+                                          if match_id not in retried_match_ids]
+                finally:
+                    # Progress is reported from here on, even if the history could not be listed
+                    progress.add_total(listed_count, final=True)
+                progress.advance(listed_count - len(new_match_ids))
+                yield from new_match_ids
 
-            # First fetch the matches already in the database
-            for match_id in stored_match_history:
-                stored_model: MatchModel = MatchModel.select().where(MatchModel.match_id == match_id).get()
+            def fetch(match_id: str) -> Union[Tuple[str, Dict], FailedMatch]:
+                logger.debug(f'Match with ID {match_id} not found, storing...')
+                match_info: Optional[Dict] = self._fetch_match_info(match_id)
+                if match_info is None:
+                    # Recorded along with the matches of its batch, so it is fetched again on the next sync
+                    failed_match_ids.append(match_id)
+                    return FailedMatch(match_id)
+                return match_id, match_info
 
-                match = Match(match_model=model_to_dict(stored_model))
-                all_matches.append(match)
+            def parse(fetched: Union[Tuple[str, Dict], FailedMatch]) \
+                    -> Optional[Union[Tuple[Dict, Match], IgnoredMatch, FailedMatch]]:
+                if isinstance(fetched, FailedMatch):
+                    return fetched
+                match_id, match_info = fetched
+                if not self._is_supported_game_mode(match_info):
+                    # Stored along with the matches of its batch
+                    return IgnoredMatch(match_id, match_info)
+                fields: Optional[Dict] = self._build_match_fields(match_info, puuid)
+                if fields is None:
+                    progress.advance()
+                    return None
+                # Hand the already parsed match info to the analysis instead of its JSON
+                return fields, Match(match_model=dict(fields, raw_json=match_info))
 
-                modified: bool = False
-                if match.map_id is None or match.map_id == '':
-                    logger.debug(f'No map ID found for match {match_id}!')
-                    stored_model.map_id = match.map_id = match.get_map_id()
-                    logger.debug(f"Set map_id to {match.map_id}")
-                    modified = True
-                # Stats have not been calculated for this match or stats schema has been updated
-                if ValorantConstants.DebugMatchUUID or match.stats is None or match.stats.get('version', 0) != MatchService.StatsVersion:
-                    logger.debug(f'Going to update stats for match {match_id} on map: {match.map_id}!')
-                    match.stats = self.analyze(match, self.map_service.get_map(match.map_id), puuid)
-                    stored_model.stats = json.dumps(match.stats)
-                    modified = True
-                if modified:
-                    stored_model.save()
+            def analyze(parsed: Union[Tuple[Dict, Match], IgnoredMatch, FailedMatch]) \
+                    -> Union[Tuple[Dict, List[Dict], List[Dict], Optional[List[Dict]], Match], IgnoredMatch,
+                             FailedMatch]:
+                if isinstance(parsed, (IgnoredMatch, FailedMatch)):
+                    return parsed
+                fields, match = parsed
+                game_map: GameMap = self.map_service.get_map(match.map_id)
+                kill_events: List[Dict] = self._build_kill_events(match, game_map)
+                roster: List[Dict] = self._build_roster(match)
+                match.stats, player_stats = self._analyze_kill_events(match, kill_events, roster, game_map, puuid,
+                                                                      self.analyze_all_players)
                 match.unload_match_info()
+                fields['stats'] = match.stats.encode()
+                return fields, kill_events, roster, player_stats, match
 
-                matches_processed += 1
-                progress_callback(matches_processed / total_matches)
-
-            # Sort the match IDs by descending date before storing into the database
-            online_match_history.sort(key=lambda m: datetime.fromtimestamp(m['GameStartTime'] / 1000, tz=timezone.utc),
-                                      reverse=True)
-
-            # Then fetch, store, and append the new matches
-            for match_entry in online_match_history:
-                match_id = match_entry['MatchID']
-                if match_id not in stored_match_history and match_id not in self.ignored_match_ids:
+            def persist(batch: List[Union[Tuple[Dict, List[Dict], List[Dict], Optional[List[Dict]], Match],
+                                          IgnoredMatch, FailedMatch]]) -> List[Match]:
+                matches: List[Match] = []
+                with db.connection_context(), BatchWriter(max_matches=MatchService.PersistBatchSize) as writer:
+                    for analyzed in batch:
+                        if isinstance(analyzed, IgnoredMatch):
+                            self._ignore_match(analyzed.match_id, analyzed.match_info, writer)
+                            continue
+                        if isinstance(analyzed, FailedMatch):
+                            writer.add_pending_match(analyzed.match_id, puuid)
+                            continue
+                        fields, kill_events, roster, player_stats, match = analyzed
+                        writer.add_match(fields, kill_events, roster, player_stats)
+                        matches.append(match)
+                progress.advance(len(batch))
+                return matches
 
-                    logger.debug(f'Match with ID {match_id} not found, storing...')
-                    match_info = self.api_service.get_match_info(match_id)
-                    # Only add 5v5s, no other custom gamemode
-                    if match_info['matchInfo']['gameMode'] == '/Game/GameModes/Bomb/BombGameMode.BombGameMode_C':
-                        stored_model: MatchModel = self._store_match(match_info, puuid)
-                        match = Match(match_model=model_to_dict(stored_model))
+            pipeline = Pipeline(list_new_match_ids(), [
+                Stage('fetch', fetch, workers=self.fetch_concurrency),
+                Stage('parse', parse),
+                Stage('analyze', analyze),
+                Stage('persist', persist, batch_size=MatchService.PersistBatchSize)
+            ])
+            pipeline.start()
 
-                        # Now compute the stats and update the stored model
-                        match.stats = self.analyze(match, self.map_service.get_map(match.map_id), puuid)
-                        match.unload_match_info()
-                        stored_model.stats = json.dumps(match.stats)
-                        stored_model.save()
+            # Load the matches already in the database while new ones are downloading, collecting the new ones
+            # as they are stored
+            for match in self._load_stored_matches(puuid):
+                all_matches.append(match)
+                progress.advance()
+                all_matches.extend(pipeline.take_ready_results())
 
-                        all_matches.append(match)
-                    else:
-                        self.ignored_match_ids[match_id] = True
+            all_matches.extend(pipeline.results())
+            pipeline.log_counters()
 
-                matches_processed += 1
-                progress_callback(matches_processed / total_matches)
+            # Everything listed has been stored, ignored or recorded as pending, so later syncs can stop here
+            self._update_sync_watermarks(puuid, queue_histories, watermarks)
+            if failed_match_ids:
+                logger.warning(f'{len(failed_match_ids)} matches could not be fetched and will be retried next sync')
 
             all_matches.sort(key=lambda m: m.date, reverse=True)
         except Exception as e:  # not authenticated, use local matches
             logger.error(f'Exception during match processing: {str(e)}')
             logger.error(traceback.format_exc())
+            if pipeline is not None:
+                pipeline.abort()
             # query = MatchModel.select().order_by(MatchModel.match_date.desc())
             # for match in query:
             #     all_matches.append(Match(match_model=model_to_dict(match)))
+        progress.finish()
         return all_matches
 
-    def _get_kill_info(self, kill_event: Dict) -> Tuple[str, Dict, str, Optional[Dict]]:
+    @staticmethod
+    def _get_kill_info(kill_event: Dict) -> Tuple[str, Dict, str, Optional[Dict]]:
         victim = kill_event.get('victim', None)
         killer = kill_event.get('killer', None)
 
@@ -288,95 +964,183 @@ class MatchService:
             killer_pos = None
         return victim, victim_pos, killer, killer_pos
 
-    def analyze(self, match: Match, game_map: GameMap, puuid: str):
-        # Initialize analysis result dictionary
-        result: Dict = {
-            'version': MatchService.StatsVersion,
-            'attacker': {
-                'preplant': {
-                    'zones': {}
-                },
-                'postplant': {
-                    'zones': {}
-                }
-            },
-            'defender': {
-                'preplant': {
-                    'zones': {}
-                },
-                'postplant': {
-                    'zones': {}
-                }
-            }
-        }
-        for zone_name in game_map.get_zones():
-            for side in ('attacker', 'defender'):
-                for plant_time in ('preplant', 'postplant'):
-                    result[side][plant_time]['zones'][zone_name] = {
-                        'k': 0, 'd': 0, 'events': []
-                    }
-
-        player_team: str = match.get_player_team()
-
-        plant_times: List[int] = [game_round.get('plantRoundTime', 1000000) for game_round in match.get_rounds()]
-        
-        for kill_event in match.get_kills():
-            event_pos: Optional[Dict[str, int]] = None
-            role_value: Optional[str] = None
-            stat_key: Optional[str] = None
+    @staticmethod
+    def _get_side(team: Optional[str], round_id: int) -> Optional[str]:
+        """
+        :return: 'attacker' or 'defender', or None for an invalid team value
+        """
+        if team == ValorantConstants.Team.Red.value:
+            return 'attacker' if round_id < 12 else 'defender'
+        elif team == ValorantConstants.Team.Blue.value:
+            return 'defender' if round_id < 12 else 'attacker'
+        return None
+
+    @staticmethod
+    def _build_kill_events(match: Match, game_map: GameMap) -> List[Dict]:
+        """
+        Extract the kill events of a match as KillEventModel rows.
+        """
+        player_teams: Dict[str, str] = match.get_player_teams()
+        plant_times: List[int] = match.get_plant_round_times()
 
+        kill_events: List[Dict] = []
+        for kill_event in match.get_kills():
             round_id: int = kill_event.get('round', -1)
             if round_id == -1:
                 continue
-            victim, victim_pos, killer, killer_pos = self._get_kill_info(kill_event)
-            if victim == puuid:  # Got killed here
-                role_value = 'v'
-                event_pos = victim_pos
-                stat_key = 'd'
-            elif killer == puuid:  # Killed someone here
-                role_value = 'k'
-                event_pos = killer_pos
-                stat_key = 'k'
-
-            # Event either doesn't have to do with this player or killer could not be located
-            if event_pos is None or role_value is None or stat_key is None:
-                continue
-
-            # Which side was the player on?
-            event_side: Optional[str] = None
-            if player_team == ValorantConstants.Team.Red.value:
-                if round_id < 12:
-                    event_side = 'attacker'
-                else:
-                    event_side = 'defender'
-            elif player_team == ValorantConstants.Team.Blue.value:
-                if round_id < 12:
-                    event_side = 'defender'
-                else:
-                    event_side = 'attacker'
-            # Invalid team value
-            if event_side is None:
-                logger.warning(f'Processed kill event with invalid team value of {player_team}')
-                continue
-
             round_time: int = kill_event.get('roundTime', -1)
             if round_time == -1:
                 logger.warning(f'Processed kill event with invalid round time')
                 continue
-            event_plant_time: str = 'preplant' if round_time < plant_times[round_id] else 'postplant'
+            victim, victim_pos, killer, killer_pos = MatchService._get_kill_info(kill_event)
+            kill_events.append({
+                'match': match.match_id,
+                'map_id': match.map_id,
+                'round': round_id,
+                'round_time': round_time,
+                'plant_phase': 'preplant' if round_time < plant_times[round_id] else 'postplant',
+                'killer_puuid': killer,
+                'killer_x': None if killer_pos is None else killer_pos['x'],
+                'killer_y': None if killer_pos is None else killer_pos['y'],
+                'killer_side': MatchService._get_side(player_teams.get(killer), round_id),
+                'victim_puuid': victim,
+                'victim_x': victim_pos['x'],
+                'victim_y': victim_pos['y'],
+                'victim_side': MatchService._get_side(player_teams.get(victim), round_id)
+            })
+        MatchService._classify_kill_events(kill_events, game_map)
+        return kill_events
 
-            zone = game_map.get_zone_from_game_coords(event_pos['x'], event_pos['y'])
-            if zone is None:
-                continue
+    @staticmethod
+    def _build_roster(match: Match) -> List[Dict]:
+        """
+        Extract the players of a match as MatchPlayerModel rows.
+        """
+        return [dict(match=match.match_id, puuid=player, team=team)
+                for player, team in match.get_player_teams().items()]
 
-            result[event_side][event_plant_time]['zones'][zone.name][stat_key] += 1
-            if killer_pos is not None and victim_pos is not None:
-                result[event_side][event_plant_time]['zones'][zone.name]['events'].append({
-                    'r': role_value, 'k': [killer_pos['x'], killer_pos['y']], 'v': [victim_pos['x'], victim_pos['y']]
-                })
-        return result
+    @staticmethod
+    def _classify_kill_events(kill_events: List[Dict], game_map: GameMap):
+        """
+        Resolve the zones of the killer and victim positions of kill events, in place, classifying all of the
+        positions of a match at once.
+        """
+        located_killers: List[Dict] = [kill_event for kill_event in kill_events if kill_event['killer_x'] is not None]
+        positions: List[Tuple[int, int]] = [(kill_event['victim_x'], kill_event['victim_y'])
+                                            for kill_event in kill_events]
+        positions.extend((kill_event['killer_x'], kill_event['killer_y']) for kill_event in located_killers)
+        ordinals: List[int] = game_map.classify_game_coords(positions, MatchService.ZoneGapDistance).tolist()
+        zone_names: List[Optional[str]] = [None if ordinal < 0 else game_map.zone_list[ordinal].name
+                                           for ordinal in ordinals]
+
+        for kill_event, zone_name in zip(kill_events, zone_names):
+            kill_event['victim_zone'] = zone_name
+            kill_event['killer_zone'] = None
+        for kill_event, zone_name in zip(located_killers, zone_names[len(kill_events):]):
+            kill_event['killer_zone'] = zone_name
+
+    @staticmethod
+    def _aggregate_kill_events(kill_events: List[Dict], game_map: GameMap, puuid: str) -> MatchStats:
+        """
+        Compute the stats of a player from the kill events of a match.
+        """
+        return MatchService._aggregate_players_kill_events(kill_events, game_map, {puuid})[puuid]
+
+    @staticmethod
+    def _aggregate_players_kill_events(kill_events: List[Dict], game_map: GameMap, puuids: Set[str]) \
+            -> Dict[str, MatchStats]:
+        """
+        Compute the stats of several players from the kill events of a match, in a single pass over them.
+        """
+        events: Dict[str, List[Tuple[int, int, int, int, Optional[Tuple[int, int]], Tuple[int, int]]]] = \
+            {puuid: [] for puuid in puuids}
+        for kill_event in kill_events:
+            killer: Optional[str] = kill_event['killer_puuid']
+            victim: str = kill_event['victim_puuid']
+            players: List[Tuple[str, str, Optional[str], Optional[str]]] = []
+            if victim in events:  # Got killed here
+                players.append((victim, 'v', kill_event['victim_side'], kill_event['victim_zone']))
+            # Killing yourself only counts as a death, and killers that could not be located are left out
+            if killer in events and killer != victim and kill_event['killer_x'] is not None:  # Killed someone here
+                players.append((killer, 'k', kill_event['killer_side'], kill_event['killer_zone']))
+
+            for player, role_value, event_side, zone_name in players:
+                # Invalid team value
+                if event_side is None:
+                    logger.warning(f'Processed kill event with invalid team value')
+                    continue
+                if zone_name is None:
+                    continue
+
+                killer_pos = None if kill_event['killer_x'] is None \
+                    else (kill_event['killer_x'], kill_event['killer_y'])
+                events[player].append((Sides.index(event_side), PlantTimes.index(kill_event['plant_phase']),
+                                       game_map.zone_ordinals[zone_name], Roles.index(role_value),
+                                       killer_pos, (kill_event['victim_x'], kill_event['victim_y'])))
+        return {player: MatchStats.from_events(MatchService.StatsVersion, game_map, player_events)
+                for player, player_events in events.items()}
+
+    @staticmethod
+    def _analyze_kill_events(match: Match, kill_events: List[Dict], roster: List[Dict], game_map: GameMap,
+                             puuid: str, all_players: bool) -> Tuple[MatchStats, Optional[List[Dict]]]:
+        """
+        Compute the stats of a player from the kill events of a match, and those of every player of it if
+        all_players is set, including those who neither killed nor died.
+        :param roster: the MatchPlayerModel rows of the match
+        :return: the stats of the player, and the PlayerStatsModel rows of all players or None
+        """
+        if not all_players:
+            return MatchService._aggregate_kill_events(kill_events, game_map, puuid), None
+        players: Set[str] = {row['puuid'] for row in roster} | MatchService._get_kill_event_players(kill_events)
+        players_stats: Dict[str, MatchStats] = MatchService._aggregate_players_kill_events(
+            kill_events, game_map, players | {puuid})
+        return players_stats[puuid], [dict(match=match.match_id, puuid=player, map_id=match.map_id,
+                                           stats=stats.encode()) for player, stats in players_stats.items()]
+
+    @staticmethod
+    def _get_kill_event_players(kill_events: List[Dict]) -> Set[str]:
+        players: Set[str] = {kill_event['victim_puuid'] for kill_event in kill_events}
+        players.update(kill_event['killer_puuid'] for kill_event in kill_events
+                       if kill_event['killer_puuid'] is not None)
+        return players
+
+    def analyze(self, match: Match, game_map: GameMap, puuid: str):
+        return self._aggregate_kill_events(self._build_kill_events(match, game_map), game_map, puuid)
+
+    def analyze_players(self, match: Match, game_map: GameMap) -> Dict[str, MatchStats]:
+        """
+        Compute the stats of every player of a match, from a single parse of the match and a single classification
+        of its kill positions.
+        """
+        kill_events: List[Dict] = self._build_kill_events(match, game_map)
+        players: Set[str] = set(match.get_player_teams()) | self._get_kill_event_players(kill_events)
+        return self._aggregate_players_kill_events(kill_events, game_map, players)
+
+    @staticmethod
+    def get_player_stats(match_id: str) -> Dict[str, MatchStats]:
+        """
+        :return: the stored stats of every player of a match by PUUID, empty if its players were not all analyzed
+        """
+        query = PlayerStatsModel.select(PlayerStatsModel.puuid, PlayerStatsModel.stats) \
+            .where(PlayerStatsModel.match == match_id)
+        return {puuid: MatchStats.decode(stats) for puuid, stats in query.tuples()}
 
     def on_close(self):
         db.close()
-        with open(FileManager.get_storage_path('storage.json'), 'w') as f:
-            f.write(json.dumps(self.ignored_match_ids))
+
+
+# Map geometry of a re-analysis worker process, loaded once when the process starts
+worker_map_service: Optional[MapService] = None
+
+
+def init_reanalysis_worker(database_path: str):
+    global worker_map_service
+    worker_map_service = MapService()
+    worker_map_service.load_maps()
+    db.init(database_path)
+
+
+def reanalyze_in_worker(task: Tuple[Match, str, bool]) \
+        -> Tuple[Dict, List[Dict], Optional[List[Dict]], Optional[List[Dict]]]:
+    match, puuid, all_players = task
+    return MatchService._reanalyze_stored_match(match, puuid, worker_map_service, all_players)
@@ -0,0 +1,257 @@
+import time
+import queue
+import threading
+import traceback
+from typing import Callable, Iterable, List, Optional, Any, Dict
+
+from src.utils import logger
+
+
+class StageCounter:
+
+    def __init__(self):
+        self.lock: threading.Lock = threading.Lock()
+        self.items_in: int = 0
+        self.items_out: int = 0
+        self.busy_seconds: float = 0.0
+
+    def record(self, items_in: int, items_out: int, busy_seconds: float):
+        with self.lock:
+            self.items_in += items_in
+            self.items_out += items_out
+            self.busy_seconds += busy_seconds
+
+    def get_throughput(self) -> float:
+        """
+        :return: items handled per second of work, summed over the stage's workers
+        """
+        with self.lock:
+            return self.items_in / self.busy_seconds if self.busy_seconds > 0 else 0.0
+
+    def __str__(self):
+        return f'{self.items_in} in, {self.items_out} out, {self.get_throughput():.1f}/s'
+
+
+class Stage:
+    """
+    A step of a Pipeline.
+    With batch_size 0, func is called with every item and returns the item to pass on, or None to drop it.
+    Otherwise func is called with lists of up to batch_size items, flushed at least every flush_interval
+    seconds, and returns the list of items to pass on.
+    """
+
+    def __init__(self, name: str, func: Callable, workers: int = 1, batch_size: int = 0,
+                 flush_interval: float = 0.5):
+        self.name: str = name
+        self.func: Callable = func
+        self.workers: int = max(1, workers)
+        self.batch_size: int = batch_size
+        self.flush_interval: float = flush_interval
+
+
+class Pipeline:
+    """
+    Runs each stage on its own threads, connected by bounded queues, so a slow stage applies backpressure
+    to the ones before it instead of letting work pile up in memory. The results of the last stage are collected
+    in an unbounded queue, so the stages never wait for the consumer, which may be busy with other work.
+    """
+
+    _Done = object()
+    PollInterval: float = 0.1
+
+    def __init__(self, source: Iterable, stages: List[Stage], queue_size: int = 16):
+        self.source: Iterable = source
+        self.stages: List[Stage] = stages
+        # queues[i] feeds stages[i], the last queue collects the results
+        self.queues: List[queue.Queue] = [queue.Queue(maxsize=queue_size) for _ in range(len(stages))]
+        self.queues.append(queue.Queue())
+        self.counters: Dict[str, StageCounter] = {'source': StageCounter()}
+        self.counters.update({stage.name: StageCounter() for stage in stages})
+        self.remaining_workers: List[int] = [stage.workers for stage in stages]
+        self.remaining_lock: threading.Lock = threading.Lock()
+        self.aborted: threading.Event = threading.Event()
+        self.error: Optional[BaseException] = None
+        self.threads: List[threading.Thread] = []
+
+    def _put(self, index: int, item: Any):
+        while not self.aborted.is_set():
+            try:
+                self.queues[index].put(item, timeout=Pipeline.PollInterval)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, index: int, timeout: Optional[float] = None) -> Any:
+        deadline: Optional[float] = None if timeout is None else time.monotonic() + timeout
+        while not self.aborted.is_set():
+            wait: float = Pipeline.PollInterval if deadline is None \
+                else min(Pipeline.PollInterval, deadline - time.monotonic())
+            if wait <= 0:
+                raise queue.Empty
+            try:
+                return self.queues[index].get(timeout=wait)
+            except queue.Empty:
+                pass
+        return Pipeline._Done
+
+    def _fail(self, e: BaseException):
+        logger.error(f'Pipeline failed: {str(e)}')
+        logger.error(traceback.format_exc())
+        if self.error is None:
+            self.error = e
+        self.aborted.set()
+
+    def _finish_worker(self, index: int):
+        # The last worker of a stage to finish tells every worker of the next stage to stop
+        with self.remaining_lock:
+            self.remaining_workers[index] -= 1
+            is_last: bool = self.remaining_workers[index] == 0
+        if is_last:
+            next_workers: int = self.stages[index + 1].workers if index + 1 < len(self.stages) else 1
+            for _ in range(next_workers):
+                self._put(index + 1, Pipeline._Done)
+
+    def _run_source(self):
+        counter: StageCounter = self.counters['source']
+        try:
+            iterator = iter(self.source)
+            while not self.aborted.is_set():
+                start: float = time.perf_counter()
+                item = next(iterator, Pipeline._Done)
+                if item is Pipeline._Done:
+                    break
+                counter.record(1, 1, time.perf_counter() - start)
+                self._put(0, item)
+        except BaseException as e:
+            self._fail(e)
+        for _ in range(self.stages[0].workers if self.stages else 1):
+            self._put(0, Pipeline._Done)
+
+    def _run_stage(self, index: int):
+        stage: Stage = self.stages[index]
+        counter: StageCounter = self.counters[stage.name]
+        try:
+            if stage.batch_size > 0:
+                self._run_batches(index, stage, counter)
+            else:
+                while (item := self._get(index)) is not Pipeline._Done:
+                    start: float = time.perf_counter()
+                    result = stage.func(item)
+                    counter.record(1, 0 if result is None else 1, time.perf_counter() - start)
+                    if result is not None:
+                        self._put(index + 1, result)
+        except BaseException as e:
+            self._fail(e)
+        self._finish_worker(index)
+
+    def _run_batches(self, index: int, stage: Stage, counter: StageCounter):
+        batch: List = []
+        done: bool = False
+        while not done:
+            flush_at: float = time.monotonic() + stage.flush_interval
+            while len(batch) < stage.batch_size:
+                try:
+                    item = self._get(index, timeout=max(0.0, flush_at - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is Pipeline._Done:
+                    done = True
+                    break
+                batch.append(item)
+            if batch and not self.aborted.is_set():
+                start: float = time.perf_counter()
+                results: List = stage.func(batch)
+                counter.record(len(batch), len(results), time.perf_counter() - start)
+                for result in results:
+                    self._put(index + 1, result)
+                batch = []
+
+    def start(self):
+        self.threads.append(threading.Thread(target=self._run_source, name='Pipeline-source', daemon=True))
+        for index, stage in enumerate(self.stages):
+            for worker in range(stage.workers):
+                self.threads.append(threading.Thread(target=self._run_stage, args=(index,),
+                                                     name=f'Pipeline-{stage.name}-{worker}', daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def results(self) -> Iterable:
+        """
+        Yield the output of the last stage as it is produced, until every stage is done.
+        :raises: the first exception raised by a stage
+        """
+        while (item := self._get(len(self.stages))) is not Pipeline._Done:
+            yield item
+        for thread in self.threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def take_ready_results(self) -> List:
+        """
+        Take the output of the last stage produced so far, without waiting for more.
+        """
+        items: List = []
+        while True:
+            try:
+                item = self.queues[-1].get_nowait()
+            except queue.Empty:
+                return items
+            if item is Pipeline._Done:
+                # Left for results(), which joins the threads and raises their errors
+                self.queues[-1].put(item)
+                return items
+            items.append(item)
+
+    def abort(self):
+        self.aborted.set()
+        for thread in self.threads:
+            thread.join()
+
+    def log_counters(self):
+        for name, counter in self.counters.items():
+            logger.debug(f'Pipeline stage {name}: {str(counter)}')
+
+
+class ProgressTracker:
+    """
+    Thread-safe progress reporting for work whose total is counted in several parts, some of which are only known
+    while the work is already being processed. Progress is held back until every part of the total is known, so
+    work processed early can't report completion of a total that is still incomplete.
+    """
+
+    def __init__(self, callback: Optional[Callable[[float], None]], pending_totals: int = 0):
+        """
+        :param pending_totals: number of add_total calls with final set to wait for before reporting progress
+        """
+        self.callback: Optional[Callable[[float], None]] = callback
+        self.lock: threading.Lock = threading.Lock()
+        self.total: int = 0
+        self.processed: int = 0
+        self.pending_totals: int = pending_totals
+
+    def add_total(self, count: int, final: bool = False):
+        """
+        :param final: this is one of the pending parts of the total
+        """
+        with self.lock:
+            self.total += count
+            if final:
+                self.pending_totals -= 1
+            self._report()
+
+    def advance(self, count: int = 1):
+        with self.lock:
+            self.processed += count
+            self._report()
+
+    def _report(self):
+        if self.pending_totals > 0 or self.callback is None:
+            return
+        self.callback(1.0 if self.total == 0 else min(1.0, self.processed / self.total))
+
+    def finish(self):
+        with self.lock:
+            self.pending_totals = 0
+            if self.callback is not None:
+                self.callback(1.0)
@@ -23,9 +23,10 @@ class AnalyzeMatchesWorker(QObject):
     result: SignalInstance = Signal()
     finished: SignalInstance = Signal()
 
-    def __init__(self, matches: List[Match], analytics_service: AnalyticsService):
+    def __init__(self, matches: List[Match], puuid: str, analytics_service: AnalyticsService):
         super().__init__(None)
         self.matches: List[Match] = matches
+        self.puuid: str = puuid
         self.analytics_service: AnalyticsService = analytics_service
         self.thread: Optional[Thread] = None
 
@@ -34,8 +35,9 @@ class AnalyzeMatchesWorker(QObject):
         self.thread.start()
 
     def run(self):
-        self.analytics_service.aggregate_statistics(self.matches)
+        self.analytics_service.aggregate_statistics(self.matches, self.puuid)
         self.result.emit()
+        self.analytics_service.save_snapshot()
         self.finished.emit()
 
 
@@ -56,6 +58,7 @@ class MainController(QObject):
         self.main_view.tabs.currentChanged.connect(self.on_tab_changed)
 
         self._init_services()
+        self._load_statistics_snapshot()
         self._init_controllers()
 
     def _init_settings(self):
@@ -64,6 +67,15 @@ class MainController(QObject):
             self.settings.setValue('region', ApiService.get_regions()[0])
             logger.debug('Region has not been set yet.')
 
+    def _load_statistics_snapshot(self):
+        """
+        Show the statistics of the last player right away, until their matches are fetched again.
+        """
+        self.player_data.puuid_changed.connect(lambda puuid: self.settings.setValue('puuid', puuid))
+        puuid: Optional[str] = self.settings.value('puuid', None)
+        if puuid and self.analytics_service.load_snapshot(puuid):
+            self.main_view.set_map_tab_enabled(True)
+
     def _init_controllers(self):
         self._init_general_controller()
         self._init_map_controller()
@@ -114,6 +126,7 @@ class MainController(QObject):
 
         self.match_service: MatchService = MatchService(self.api_service, self.map_service)
         self.main_view.close_event_signal.connect(self.match_service.on_close)
+        self.main_view.close_event_signal.connect(self.api_service.on_close)
 
         self.analytics_service: AnalyticsService = AnalyticsService(self.map_service)
 
@@ -138,7 +151,8 @@ class MainController(QObject):
             del self.worker
             self.main_view.set_map_tab_enabled(True)
 
-        self.worker = AnalyzeMatchesWorker(self.player_data.available_matches, self.analytics_service)
+        self.worker = AnalyzeMatchesWorker(self.player_data.available_matches, self.player_data.puuid,
+                                           self.analytics_service)
         self.worker.result.connect(self.draw_stats)
         self.worker.finished.connect(on_finish_analysis)
         self.worker.start()
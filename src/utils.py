@@ -35,16 +35,22 @@ if not os.path.isdir(FileManager.get_storage_path('')):
 
 logger: logging.Logger = logging.getLogger('Valorant-Zone-Stats')
 logger.setLevel(logging.DEBUG)
-# create file handler
-fh = logging.FileHandler(FileManager.get_storage_path('debug.log'), mode='w')
-fh.setLevel(logging.DEBUG)
-
-# create formatter and add it to the handlers
-formatter = logging.Formatter(fmt='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
-                              datefmt='%H:%M:%S')
-fh.setFormatter(formatter)
-logger.addHandler(fh)
 logger.addHandler(logging.StreamHandler(sys.stdout))
 
-logger.debug('Initialized logger')
 
+def init_file_logging():
+    """
+    Also log to debug.log in the storage directory. Only the main process calls this: the file is truncated when
+    it is opened, and the re-analysis worker processes import this module too.
+    """
+    # create file handler
+    fh = logging.FileHandler(FileManager.get_storage_path('debug.log'), mode='w')
+    fh.setLevel(logging.DEBUG)
+
+    # create formatter and add it to the handlers
+    formatter = logging.Formatter(fmt='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
+                                  datefmt='%H:%M:%S')
+    fh.setFormatter(formatter)
+    logger.addHandler(fh)
+
+    logger.debug('Initialized logger')
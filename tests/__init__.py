@@ -0,0 +1,9 @@
+"""
+Run from the root directory of the project:
+    python -m unittest
+"""
+import os
+import tempfile
+
+# The storage path is read when src.utils is imported, so point it at a scratch directory first
+os.environ['APPDATA'] = tempfile.mkdtemp(prefix='vzs-tests-')
@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from typing import Dict, Optional, Set
+
+from scripts.mock_pd_server import MatchGenerator, MockPDServer, MockPUUID
+from src.services.api_service import ApiService
+from src.services.map_service import MapService
+from src.services.match_service import db, MatchService, MatchModel, PendingMatchModel, PlayerStatsModel
+
+
+class FlakyMockPDServer(MockPDServer):
+    """
+    Answers 404 to the first request for the details of each match in fail_once.
+    """
+
+    def __init__(self, address, generator: MatchGenerator):
+        super().__init__(address, generator=generator)
+        self.fail_once: Set[str] = set()
+
+    def get_match(self, match_id: str) -> Optional[Dict]:
+        if match_id in self.fail_once:
+            self.fail_once.discard(match_id)
+            return None
+        return super().get_match(match_id)
+
+
+class QuietPlayerMatchGenerator(MatchGenerator):
+    """
+    Builds matches in which the last player neither kills nor dies.
+    """
+
+    def get_match(self, index: int) -> Dict:
+        match: Dict = super().get_match(index)
+        quiet_player: str = self.players[-1]
+        match['kills'] = [kill for kill in match['kills'] if quiet_player not in (kill['killer'], kill['victim'])]
+        return match
+
+
+class MatchServiceTestCase(unittest.TestCase):
+
+    analyze_all_players: bool = False
+
+    def setUp(self):
+        # A database of its own for every test
+        self.storage_directory: str = tempfile.mkdtemp(prefix='vzs-tests-')
+        os.environ['APPDATA'] = self.storage_directory
+        os.makedirs(os.path.join(self.storage_directory, 'Valorant-Zone-Stats'))
+
+        self.generator = QuietPlayerMatchGenerator(0, ignored_ratio=0.0)
+        self.server = FlakyMockPDServer(('127.0.0.1', 0), self.generator)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.api_service = ApiService('NA', pool_size=4)
+        self.api_service.api.pd_url_override = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.api_service.api.cached_headers = {'Authorization': 'Bearer mock', 'X-Riot-Entitlements-JWT': 'mock'}
+        self.api_service.puuid = MockPUUID
+        self.api_service.is_authed = True
+
+        map_service = MapService()
+        map_service.load_maps()
+        self.match_service = MatchService(self.api_service, map_service, reanalysis_workers=1,
+                                          analyze_all_players=self.analyze_all_players)
+
+    def tearDown(self):
+        self.match_service.on_close()
+        # The next test points the database at another file, so none of these connections may be reused
+        db.close_all()
+        self.api_service.on_close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.storage_directory, ignore_errors=True)
+
+    def set_match_count(self, match_count: int):
+        self.generator.match_count = match_count
+        # Listed again from the generator
+        self.server.histories = {}
+
+    @staticmethod
+    def get_stored_match_ids() -> Set[str]:
+        return {match_id for match_id, in MatchModel.select(MatchModel.match_id).tuples()}
+
+
+class ProcessMatchesTest(MatchServiceTestCase):
+
+    def test_failed_fetch_is_retried_next_sync(self):
+        self.set_match_count(10)
+        self.match_service.process_matches(MockPUUID)
+
+        # Enough newer matches that the one that fails ends up past the first history page of its queue
+        self.set_match_count(70)
+        failed_match_id: str = MatchGenerator.get_match_id(10)
+        self.server.fail_once.add(failed_match_id)
+        matches = self.match_service.process_matches(MockPUUID)
+        self.assertEqual(len(matches), 69)
+        self.assertNotIn(failed_match_id, self.get_stored_match_ids())
+        self.assertEqual([match_id for match_id, in PendingMatchModel.select(PendingMatchModel.match_id).tuples()],
+                         [failed_match_id])
+
+        # The first history page of every queue is stored, so listing stops before the failed match
+        matches = self.match_service.process_matches(MockPUUID)
+        self.assertEqual(len(matches), 70)
+        self.assertIn(failed_match_id, self.get_stored_match_ids())
+        self.assertEqual(PendingMatchModel.select().count(), 0)
+
+
+class AnalyzeAllPlayersTest(MatchServiceTestCase):
+
+    analyze_all_players = True
+
+    def test_players_without_kills_get_stats(self):
+        self.set_match_count(3)
+        self.match_service.process_matches(MockPUUID)
+        for index in range(3):
+            player_stats = MatchService.get_player_stats(MatchGenerator.get_match_id(index))
+            self.assertEqual(set(player_stats), set(self.generator.players))
+
+    def test_stored_matches_are_reanalyzed_without_match_details(self):
+        self.set_match_count(3)
+        self.match_service.process_matches(MockPUUID)
+
+        # Outdated stats, and match details that can't be analyzed anymore
+        PlayerStatsModel.delete().execute()
+        MatchModel.update(stats=None, raw_json='{}').execute()
+        matches = self.match_service.process_matches(MockPUUID)
+        self.assertEqual(len(matches), 3)
+        for index in range(3):
+            player_stats = MatchService.get_player_stats(MatchGenerator.get_match_id(index))
+            self.assertEqual(set(player_stats), set(self.generator.players))
+
+
+if __name__ == '__main__':
+    unittest.main()